@@ -1,29 +1,125 @@
 from aiogram import Router
 from aiogram.filters import Command
 from aiogram.types import Message
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from database.database import get_session
 from services.admin_service import AdminService
 from config.settings import ADMIN_IDS
+from utils import metrics
 
 router = Router()
 
 @router.message(Command("admin_stats"))
-async def cmd_admin_stats(message: Message):
+async def cmd_admin_stats(message: Message, session: AsyncSession):
     """ Показать статистику (только для админов) """
 
     if message.from_user.id not in ADMIN_IDS:
         await message.answer("❌ У вас нет прав для просмотра статистики")
         return
 
-    async for session in get_session():
-        stats = await AdminService.get_statistics(session)
+    stats = await AdminService.get_statistics(session)
 
-        text = (
-            "📊 <b>Статистика бота</b>\n\n"
-            f"👥 Всего пользователей: <b>{stats['total_users']}</b>\n"
-            f"✅ Выполнено квестов: <b>{stats['completed_quests']}</b>\n"
-            f"⭐ Средний уровень: <b>{stats['avg_level']}</b>\n"
+    text = (
+        "📊 <b>Статистика бота</b>\n\n"
+        f"👥 Всего пользователей: <b>{stats['total_users']}</b>\n"
+        f"🔥 Активных сегодня (DAU): <b>{stats['dau']}</b>\n"
+        f"✅ Выполнено квестов: <b>{stats['completed_quests']}</b>\n"
+        f"⭐ Средний уровень: <b>{stats['avg_level']}</b>\n"
+    )
+
+    if stats['completion_by_difficulty']:
+        text += "\n🎯 <b>Выполнение по сложности</b>\n"
+        for difficulty, rate in sorted(stats['completion_by_difficulty'].items()):
+            text += f"{difficulty}: <b>{rate}%</b>\n"
+
+    for days, trend in stats['trends'].items():
+        text += (
+            f"\n📈 <b>За {days} дней</b>\n"
+            f"Новых пользователей: <b>{trend['new_users']}</b>\n"
+            f"Выдано квестов: <b>{trend['quests_issued']}</b>\n"
+            f"Выполнено: <b>{trend['quests_completed']}</b>, "
+            f"провалено: <b>{trend['quests_failed']}</b>\n"
+            f"Средний DAU: <b>{trend['avg_dau']}</b>\n"
+        )
+
+    await message.answer(text, parse_mode="HTML")
+
+@router.message(Command("admin_metrics"))
+async def cmd_admin_metrics(message: Message):
+    """ Показать внутренние метрики бота (только для админов) """
+
+    if message.from_user.id not in ADMIN_IDS:
+        await message.answer("❌ У вас нет прав для просмотра метрик")
+        return
+
+    data = metrics.snapshot()
+
+    lines = ["📈 <b>Метрики бота</b>\n"]
+
+    pool_ratio = {
+        quest_type: metrics.hit_ratio(
+            f"quest_pool_hits_{quest_type}", f"quest_pool_misses_{quest_type}"
+        )
+        for quest_type in ("daily", "weekly")
+    }
+    lines.append(
+        f"🧺 Пул квестов (hit rate): daily <b>{pool_ratio['daily']:.0%}</b>, "
+        f"weekly <b>{pool_ratio['weekly']:.0%}</b>"
+    )
+    lines.append(
+        f"👤 Кэш пользователей (hit rate): "
+        f"<b>{metrics.hit_ratio('user_cache_hits', 'user_cache_misses'):.0%}</b>"
+    )
+
+    lines.append(
+        f"🧠 Кэш ответов LLM (hit rate): "
+        f"<b>{metrics.hit_ratio('llm_cache_hits', 'llm_cache_misses'):.0%}</b>, "
+        f"сэкономлено <b>{metrics.get_counter('llm_cache_saved_seconds'):.0f}</b> с"
+    )
+
+    offline = {
+        reason: metrics.get_counter(f"quest_source_offline_{reason}")
+        for reason in ("share", "error", "budget", "breaker")
+    }
+    lines.append(
+        "🧩 Локальные квесты: "
+        + ", ".join(f"{reason} <b>{value:g}</b>" for reason, value in offline.items())
+    )
+
+    breaker_gauge = int(data["gauges"].get("llm_breaker_state", 0))
+    breaker_state = ("closed", "half-open", "open")[breaker_gauge]
+    lines.append(
+        f"⚡ Предохранитель LLM: <b>{breaker_state}</b>, "
+        f"повторов <b>{metrics.get_counter('llm_retries'):g}</b>, "
+        f"отказов <b>{metrics.get_counter('llm_breaker_rejected'):g}</b>"
+    )
+
+    checkout = data["observations"].get("db_pool_checkout_seconds")
+    if checkout:
+        lines.append(
+            f"🔌 Соединение вне пула: avg <b>{checkout['avg']:.3f}</b> с, "
+            f"max <b>{checkout['max']:.3f}</b> с"
+        )
+    lines.append("")
+
+    rejected = {
+        command_class: metrics.get_counter(f"throttle_rejected_{command_class}")
+        for command_class in ("read", "llm", "callback")
+    }
+    lines.append(
+        "🛡 Отклонено anti-flood: "
+        + ", ".join(f"{name} <b>{value:g}</b>" for name, value in rejected.items())
+        + "\n"
+    )
+
+    for name, value in sorted(data["counters"].items()):
+        lines.append(f"{name}: <b>{value:g}</b>")
+    for name, value in sorted(data["gauges"].items()):
+        lines.append(f"{name}: <b>{value:g}</b>")
+    for name, stats in sorted(data["observations"].items()):
+        lines.append(
+            f"{name}: avg <b>{stats['avg']:.3f}</b>, max <b>{stats['max']:.3f}</b>, "
+            f"n=<b>{stats['count']:g}</b>"
         )
 
-        await message.answer(text, parse_mode="HTML")
\ No newline at end of file
+    await message.answer("\n".join(lines), parse_mode="HTML")
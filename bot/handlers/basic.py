@@ -1,19 +1,24 @@
 """
 Обработчики базовых команд бота.
 """
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
 from aiogram import Router, F
-from aiogram.filters import CommandStart, Command
+from aiogram.filters import CommandStart, Command, CommandObject
 from aiogram.types import Message
-from database.database import async_session_maker
-from database.crud import get_or_create_user, save_message
+from sqlalchemy.ext.asyncio import AsyncSession
+from config.settings import DEFAULT_DELIVERY_HOUR
+from database.crud import get_or_create_user, set_user_timezone, set_user_delivery_hour
+from services.chat_history_service import chat_history_buffer
 from bot.keyboards.reply import get_main_menu
+from bot.middlewares.db_session import rollback_update
 from utils.logger import logger
 
 router = Router()
 
 
 @router.message(CommandStart())
-async def cmd_start(message: Message):
+async def cmd_start(message: Message, session: AsyncSession):
     """
     Обработчик команды /start.
     Регистрирует пользователя в БД и приветствует.
@@ -25,77 +30,131 @@ async def cmd_start(message: Message):
     )
 
     try:
-        async with async_session_maker() as session:
-            user = await get_or_create_user(
-                session=session,
-                telegram_id=message.from_user.id,
-                username=message.from_user.username,
-                first_name=message.from_user.first_name
-            )
-
-            await save_message(
-                session=session,
-                user_id=user.id,
-                message_text=message.text,
-                is_from_user=True
-            )
-
-            response_text = (
-                f"👋 Приветствую, {message.from_user.first_name}!\n\n"
-                "⚔️ Я СИСТЕМА ПРОКАЧКИ\n\n"
-                "Я буду выдавать тебе квесты для саморазвития. "
-                "Твоя задача — выполнять их и становиться лучше с каждым днем.\n\n"
-                "Система не прощает слабости.\n"
-                "Только упорство ведет к победе.\n\n"
-                "Используй /help чтобы узнать команды."
-            )
-
-            await message.answer(response_text, reply_markup=get_main_menu())
-
-            await save_message(
-                session=session,
-                user_id=user.id,
-                message_text=response_text,
-                is_from_user=False
-            )
+        user = await get_or_create_user(
+            session=session,
+            telegram_id=message.from_user.id,
+            username=message.from_user.username,
+            first_name=message.from_user.first_name
+        )
+
+        chat_history_buffer.save_message_after_commit(
+            session,
+            user_id=user.id,
+            message_text=message.text,
+            is_from_user=True
+        )
+
+        response_text = (
+            f"👋 Приветствую, {message.from_user.first_name}!\n\n"
+            "⚔️ Я СИСТЕМА ПРОКАЧКИ\n\n"
+            "Я буду выдавать тебе квесты для саморазвития. "
+            "Твоя задача — выполнять их и становиться лучше с каждым днем.\n\n"
+            "Система не прощает слабости.\n"
+            "Только упорство ведет к победе.\n\n"
+            "Используй /help чтобы узнать команды."
+        )
+
+        await message.answer(response_text, reply_markup=get_main_menu())
+
+        chat_history_buffer.save_message_after_commit(
+            session,
+            user_id=user.id,
+            message_text=response_text,
+            is_from_user=False
+        )
 
     except Exception as e:  # ← Добавлено
         logger.exception(
             "Ошибка при обработке команды /start",
             user_id=message.from_user.id
         )
+        await rollback_update(session, message.from_user.id)
         await message.answer("❌ Произошла ошибка. Попробуйте позже.")
 
 @router.message(F.text == "❓ Помощь")
 @router.message(Command("help"))
-async def cmd_help(message: Message):
+async def cmd_help(message: Message, session: AsyncSession):
     """
     Обработчик команды /help.
     """
-    async with async_session_maker() as session:
-        user = await get_or_create_user(
-            session=session,
-            telegram_id=message.from_user.id,
-            username=message.from_user.username,
-            first_name=message.from_user.first_name
+    user = await get_or_create_user(
+        session=session,
+        telegram_id=message.from_user.id,
+        username=message.from_user.username,
+        first_name=message.from_user.first_name
+    )
+
+    chat_history_buffer.save_message_after_commit(session, user.id, message.text, True)
+
+    response_text = (
+        "📋 ДОСТУПНЫЕ КОМАНДЫ\n\n"
+        "🏠 Основные:\n"
+        "/start — Перезапустить бота\n"
+        "/help — Показать команды\n\n"
+        "⚔️ Квесты:\n"
+        "/my_quests — Мои активные квесты\n"
+        "/generate_daily — Получить дейли\n"
+        "/generate_weekly — Получить недельный\n\n"
+        "🤖 Автоматическая выдача:\n"
+        "• Дейли: каждый день в твой час выдачи\n"
+        "• Недельные: каждый понедельник в твой час выдачи\n"
+        "/timezone — Часовой пояс (например, Asia/Yekaterinburg)\n"
+        "/delivery_hour — Час выдачи квестов (0-23)\n\n"
+        "💪 Доказывай Системе свою силу!"
+    )
+
+    await message.answer(response_text)
+    chat_history_buffer.save_message_after_commit(session, user.id, response_text, False)
+
+@router.message(Command("timezone"))
+async def cmd_timezone(message: Message, command: CommandObject, session: AsyncSession):
+    """
+    Устанавливает часовой пояс для автоматической выдачи квестов.
+    """
+    tz_name = (command.args or "").strip()
+
+    try:
+        ZoneInfo(tz_name)
+    except (ZoneInfoNotFoundError, ValueError):
+        await message.answer(
+            "🌍 Укажи часовой пояс в формате IANA:\n"
+            "/timezone Europe/Moscow\n"
+            "/timezone Asia/Novosibirsk"
         )
+        return
 
-        await save_message(session, user.id, message.text, True)
+    user = await get_or_create_user(
+        session=session,
+        telegram_id=message.from_user.id,
+        username=message.from_user.username,
+        first_name=message.from_user.first_name
+    )
+    await set_user_timezone(session, user.id, tz_name)
 
-        response_text = (
-            "📋 ДОСТУПНЫЕ КОМАНДЫ\n\n"
-            "🏠 Основные:\n"
-            "/start — Перезапустить бота\n"
-            "/help — Показать команды\n\n"
-            "⚔️ Квесты:\n"
-            "/my_quests — Мои активные квесты\n"
-            "/generate_daily — Получить дейли\n"
-            "/generate_weekly — Получить недельный\n\n"
-            "🤖 Автоматическая выдача:\n"
-            "• Дейли: каждый день в 9:00\n"
-            "• Недельные: каждый понедельник в 9:00\n\n"
-            "💪 Доказывай Системе свою силу!"
+    logger.info('Изменен часовой пояс', user_id=message.from_user.id, timezone=tz_name)
+    await message.answer(f"✅ Часовой пояс: {tz_name}")
+
+@router.message(Command("delivery_hour"))
+async def cmd_delivery_hour(message: Message, command: CommandObject, session: AsyncSession):
+    """
+    Устанавливает час (по местному времени) автоматической выдачи квестов.
+    """
+    args = (command.args or "").strip()
+
+    if not args.isdigit() or not 0 <= int(args) <= 23:
+        await message.answer(
+            f"⏰ Укажи час от 0 до 23, например:\n"
+            f"/delivery_hour {DEFAULT_DELIVERY_HOUR}"
         )
+        return
+
+    user = await get_or_create_user(
+        session=session,
+        telegram_id=message.from_user.id,
+        username=message.from_user.username,
+        first_name=message.from_user.first_name
+    )
+    await set_user_delivery_hour(session, user.id, int(args))
 
-        await message.answer(response_text)
-        await save_message(session, user.id, response_text, False)
+    logger.info('Изменен час рассылки', user_id=message.from_user.id, delivery_hour=int(args))
+    await message.answer(f"✅ Квесты будут приходить в {int(args)}:00 по твоему времени")
@@ -0,0 +1,56 @@
+"""
+Middleware "одна сессия БД на апдейт".
+
+Хендлер получает готовую сессию в аргументе session. Функции crud делают
+только flush, а commit выполняется здесь один раз после хендлера - все шаги
+обработки апдейта попадают в одну транзакцию. После commit сюда же ставится
+в очередь история чата апдейта. При исключении транзакция
+откатывается, а пользователь выбрасывается из кэша (кэш мог получить данные,
+которые так и не были закоммичены).
+"""
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, User
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from services.chat_history_service import chat_history_buffer
+from services.user_cache_service import user_cache
+
+
+async def rollback_update(session: AsyncSession, telegram_id: int | None) -> None:
+    """
+    Откатывает транзакцию апдейта. Для хендлеров, которые сами ловят ошибку и
+    отвечают пользователю: иначе middleware закоммитит частично сделанную работу.
+    """
+    await session.rollback()
+    if telegram_id is not None:
+        user_cache.invalidate(telegram_id)
+
+
+class DbSessionMiddleware(BaseMiddleware):
+    def __init__(self, session_maker: async_sessionmaker[AsyncSession]):
+        self._session_maker = session_maker
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any]
+    ) -> Any:
+        # Соединение берется из пула только при первом запросе хендлера
+        async with self._session_maker() as session:
+            data["session"] = session
+            try:
+                result = await handler(event, data)
+                await session.commit()
+            except Exception:
+                user: User | None = data.get("event_from_user")
+                await rollback_update(session, user.id if user else None)
+                raise
+            finally:
+                # История чата закоммиченных транзакций (в том числе промежуточных
+                # commit внутри хендлера); ожидание места в очереди тормозит апдейт
+                await chat_history_buffer.save_committed(session)
+
+        return result
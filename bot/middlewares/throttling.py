@@ -0,0 +1,92 @@
+"""
+Anti-flood middleware: token bucket на пользователя и класс команды.
+
+Отклоненный апдейт не доходит до хендлеров и БД: на нажатие кнопки
+отвечаем коротким callback.answer, на сообщение - одним предупреждением.
+"""
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from utils import metrics
+from utils.rate_limiter import TokenBucket
+
+# Команды, которые могут привести к запросу в LLM
+LLM_TRIGGERS = (
+    "⚔️ Дейли квест",
+    "🏆 Недельный квест",
+    "/generate_daily",
+    "/generate_weekly",
+)
+
+# Порог, после которого из словаря выбрасываются неиспользуемые ведра
+MAX_BUCKETS = 50_000
+
+
+def classify_update(update: Update) -> str | None:
+    """
+    Класс команды: callback, llm или read. None - апдейт не ограничиваем.
+    """
+    if update.callback_query:
+        return "callback"
+
+    if update.message:
+        text = update.message.text or ""
+        if text.startswith(LLM_TRIGGERS):
+            return "llm"
+        return "read"
+
+    return None
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    def __init__(self, limits: dict[str, tuple[float, float]]):
+        """
+        limits: класс команды -> (токенов в минуту, размер всплеска).
+        """
+        self._limits = limits
+        self._buckets: dict[tuple[int, str], TokenBucket] = {}
+        # Кого уже предупредили сообщением - чтобы не отвечать на каждый спам
+        self._warned: set[tuple[int, str]] = set()
+
+    def _get_bucket(self, key: tuple[int, str]) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= MAX_BUCKETS:
+                idle = [k for k, value in self._buckets.items() if value.is_idle()]
+                for k in idle:
+                    del self._buckets[k]
+                    self._warned.discard(k)
+            per_minute, burst = self._limits[key[1]]
+            bucket = TokenBucket(rate=per_minute / 60, capacity=burst)
+            self._buckets[key] = bucket
+        return bucket
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any]
+    ) -> Any:
+        user = data.get("event_from_user")
+        command_class = classify_update(event) if isinstance(event, Update) else None
+
+        if user is None or command_class is None:
+            return await handler(event, data)
+
+        key = (user.id, command_class)
+
+        if self._get_bucket(key).try_acquire():
+            self._warned.discard(key)
+            return await handler(event, data)
+
+        metrics.increment(f"throttle_rejected_{command_class}")
+
+        if event.callback_query:
+            await event.callback_query.answer("⏳ Слишком часто! Подожди немного.")
+        elif key not in self._warned:
+            self._warned.add(key)
+            await event.message.answer("⏳ Слишком много запросов. Подожди немного.")
+
+        return None
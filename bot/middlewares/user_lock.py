@@ -0,0 +1,56 @@
+"""
+Middleware для последовательной обработки апдейтов одного пользователя.
+
+Апдейты разных пользователей обрабатываются параллельно (не больше
+UPDATES_CONCURRENCY_LIMIT одновременно), а апдейты одного from_user.id
+идут строго по очереди - двойное нажатие не выдаст два квеста.
+"""
+import asyncio
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, User
+
+from utils import metrics
+
+
+class UserLockMiddleware(BaseMiddleware):
+    def __init__(self, concurrency_limit: int):
+        self._semaphore = asyncio.Semaphore(concurrency_limit)
+        # Замок живет, пока у пользователя есть апдейты в обработке или в очереди,
+        # поэтому память не растет от неактивных пользователей
+        self._locks: dict[int, asyncio.Lock] = {}
+        self._waiters: dict[int, int] = {}
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any]
+    ) -> Any:
+        user: User | None = data.get("event_from_user")
+
+        if user is None:
+            async with self._semaphore:
+                return await handler(event, data)
+
+        lock = self._locks.get(user.id)
+        if lock is None:
+            lock = self._locks[user.id] = asyncio.Lock()
+        self._waiters[user.id] = self._waiters.get(user.id, 0) + 1
+
+        try:
+            if lock.locked():
+                metrics.increment("user_lock_waits")
+
+            # Сначала замок пользователя, потом глобальный слот - ожидание
+            # своей очереди не занимает слот у других пользователей
+            async with lock:
+                async with self._semaphore:
+                    return await handler(event, data)
+        finally:
+            self._waiters[user.id] -= 1
+            if not self._waiters[user.id]:
+                del self._waiters[user.id]
+                del self._locks[user.id]
+            metrics.set_gauge("user_locks", len(self._locks))
@@ -22,6 +22,34 @@ BOT_TOKEN = os.getenv("BOT_TOKEN")
 ADMIN_IDS = [int(id.strip()) for id in os.getenv("ADMIN_IDS", "").split(",") if id.strip()]
 API_KEY = os.getenv("API_KEY")
 
+# Transport: polling (по умолчанию, для dev) или webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+# За балансировщиком вебхук регистрирует и рассылку запускает только один инстанс
+WEBHOOK_SET_ON_STARTUP = os.getenv("WEBHOOK_SET_ON_STARTUP", "true").lower() == "true"
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "true").lower() == "true"
+UPDATES_CONCURRENCY_LIMIT = int(os.getenv("UPDATES_CONCURRENCY_LIMIT", "100"))
+
+# Anti-flood: класс команды -> (запросов в минуту, размер всплеска)
+THROTTLE_LIMITS = {
+    "read": (
+        float(os.getenv("THROTTLE_READ_PER_MINUTE", "30")),
+        float(os.getenv("THROTTLE_READ_BURST", "5")),
+    ),
+    "llm": (
+        float(os.getenv("THROTTLE_LLM_PER_MINUTE", "3")),
+        float(os.getenv("THROTTLE_LLM_BURST", "2")),
+    ),
+    "callback": (
+        float(os.getenv("THROTTLE_CALLBACK_PER_MINUTE", "60")),
+        float(os.getenv("THROTTLE_CALLBACK_BURST", "10")),
+    ),
+}
+
 # Database
 DATABASE_TYPE = os.getenv("DATABASE_TYPE", "postgresql")
 DB_HOST = os.getenv("DB_HOST", "localhost")
@@ -33,16 +61,99 @@ DB_PASSWORD = os.getenv("DB_PASSWORD")
 # Yandex Cloud
 YANDEX_CLOUD_API_KEY = os.getenv("YANDEX_CLOUD_API_KEY")
 YANDEX_CLOUD_FOLDER = os.getenv("YANDEX_CLOUD_FOLDER")
+# Общий срок запроса к AI, включая ожидание слота и повторы
+AI_REQUEST_TIMEOUT = float(os.getenv("AI_REQUEST_TIMEOUT", "30"))
+# Таймаут одной попытки (на один квест; пачка из N квестов получает N x)
+AI_ATTEMPT_TIMEOUT = float(os.getenv("AI_ATTEMPT_TIMEOUT", "12"))
+# Ответ медленнее этого (на один квест) считается сбоем для предохранителя
+AI_LATENCY_SLO = float(os.getenv("AI_LATENCY_SLO", "8"))
+AI_MAX_ATTEMPTS = int(os.getenv("AI_MAX_ATTEMPTS", "3"))
+# Экспоненциальная пауза между попытками (full jitter): base * 2^n, не больше max
+AI_BACKOFF_BASE = float(os.getenv("AI_BACKOFF_BASE", "0.5"))
+AI_BACKOFF_MAX = float(os.getenv("AI_BACKOFF_MAX", "5"))
+# Бюджет повторов: токенов за каждый запрос и максимальный запас
+AI_RETRY_BUDGET_RATIO = float(os.getenv("AI_RETRY_BUDGET_RATIO", "0.2"))
+AI_RETRY_BUDGET_TOKENS = float(os.getenv("AI_RETRY_BUDGET_TOKENS", "10"))
+# Предохранитель: сбоев подряд до размыкания и сколько секунд он разомкнут
+AI_BREAKER_FAILURE_THRESHOLD = int(os.getenv("AI_BREAKER_FAILURE_THRESHOLD", "5"))
+AI_BREAKER_OPEN_SECONDS = float(os.getenv("AI_BREAKER_OPEN_SECONDS", "30"))
+AI_MAX_CONCURRENT_REQUESTS = int(os.getenv("AI_MAX_CONCURRENT_REQUESTS", "5"))
+# Сколько квестов просить у модели одним запросом (пул и рассылка)
+AI_BATCH_SIZE = int(os.getenv("AI_BATCH_SIZE", "5"))
+# Сколько секунд пользователь ждет AI, прежде чем получить локальный квест
+# (0 - без лимита). На рассылку пачками не действует
+AI_LATENCY_BUDGET = float(os.getenv("AI_LATENCY_BUDGET", "10"))
+# Доля запросов, которые сразу обслуживает локальный генератор (0.0-1.0)
+OFFLINE_QUEST_SHARE = float(os.getenv("OFFLINE_QUEST_SHARE", "0"))
+
+# LLM response cache
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+LLM_CACHE_TTL_HOURS = float(os.getenv("LLM_CACHE_TTL_HOURS", "24"))
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", "5000000"))
+LLM_CACHE_MAX_VARIANTS = int(os.getenv("LLM_CACHE_MAX_VARIANTS", "5"))
+# Путь к SQLite-файлу кэша; пусто - кэш только в памяти
+LLM_CACHE_DISK_PATH = os.getenv("LLM_CACHE_DISK_PATH", "")
 
 # Quest settings
 QUEST_DAILY_HOURS = float(os.getenv("QUEST_DAILY_HOURS", "24"))
 QUEST_WEEKLY_HOURS = float(os.getenv("QUEST_WEEKLY_HOURS", "168"))
 SCHEDULER_CHECK_INTERVAL = int(os.getenv("SCHEDULER_CHECK_INTERVAL", "60"))
 
+# User cache
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "600"))
+
+# Chat history write-behind
+CHAT_HISTORY_BATCH_SIZE = int(os.getenv("CHAT_HISTORY_BATCH_SIZE", "100"))
+CHAT_HISTORY_FLUSH_MS = int(os.getenv("CHAT_HISTORY_FLUSH_MS", "500"))
+CHAT_HISTORY_BUFFER_SIZE = int(os.getenv("CHAT_HISTORY_BUFFER_SIZE", "10000"))
+
+# Admin statistics
+ADMIN_STATS_CACHE_TTL = float(os.getenv("ADMIN_STATS_CACHE_TTL", "60"))
+STATS_FLUSH_INTERVAL = int(os.getenv("STATS_FLUSH_INTERVAL", "30"))
+
+# Broadcast
+BROADCAST_WORKERS = int(os.getenv("BROADCAST_WORKERS", "10"))
+BROADCAST_MAX_SEND_ATTEMPTS = int(os.getenv("BROADCAST_MAX_SEND_ATTEMPTS", "3"))
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "25"))
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))
+BROADCAST_USER_BATCH_SIZE = int(os.getenv("BROADCAST_USER_BATCH_SIZE", "500"))
+
+# Quest delivery (по локальному времени пользователя)
+DEFAULT_TIMEZONE = os.getenv("DEFAULT_TIMEZONE", "Europe/Moscow")
+DEFAULT_DELIVERY_HOUR = int(os.getenv("DEFAULT_DELIVERY_HOUR", "9"))
+DELIVERY_TICK_MINUTES = int(os.getenv("DELIVERY_TICK_MINUTES", "5"))
+DELIVERY_JITTER_MINUTES = int(os.getenv("DELIVERY_JITTER_MINUTES", "30"))
+
+# Quest pool
+QUEST_POOL_TARGET_SIZE = int(os.getenv("QUEST_POOL_TARGET_SIZE", "20"))
+QUEST_POOL_MAX_AGE_HOURS = float(os.getenv("QUEST_POOL_MAX_AGE_HOURS", "24"))
+QUEST_POOL_REFILL_HOUR = int(os.getenv("QUEST_POOL_REFILL_HOUR", "4"))
+
 if not BOT_TOKEN:
     raise ValueError("BOT_TOKEN не установлен!")
 if not DB_NAME:
     raise ValueError("DB_NAME не установлен!")
+if not 0 <= DEFAULT_DELIVERY_HOUR <= 23:
+    raise ValueError(f"DEFAULT_DELIVERY_HOUR вне диапазона 0-23: {DEFAULT_DELIVERY_HOUR}")
+if AI_MAX_ATTEMPTS < 1:
+    raise ValueError(f"AI_MAX_ATTEMPTS должен быть не меньше 1: {AI_MAX_ATTEMPTS}")
+if not 0 <= DELIVERY_JITTER_MINUTES <= 60:
+    raise ValueError(f"DELIVERY_JITTER_MINUTES вне диапазона 0-60: {DELIVERY_JITTER_MINUTES}")
+# Тики идут в :00, :N, :2N...: последний тик часа должен застать все сдвиги рассылки
+if DELIVERY_TICK_MINUTES <= 0 or 60 % DELIVERY_TICK_MINUTES:
+    raise ValueError(f"DELIVERY_TICK_MINUTES должен быть делителем 60: {DELIVERY_TICK_MINUTES}")
+if DELIVERY_JITTER_MINUTES + DELIVERY_TICK_MINUTES > 60:
+    raise ValueError(
+        "DELIVERY_JITTER_MINUTES + DELIVERY_TICK_MINUTES не должны превышать 60: "
+        f"{DELIVERY_JITTER_MINUTES} + {DELIVERY_TICK_MINUTES}"
+    )
+if BOT_MODE not in ("polling", "webhook"):
+    raise ValueError(f"Неизвестный BOT_MODE: {BOT_MODE}")
+if BOT_MODE == "webhook" and not WEBHOOK_SECRET:
+    raise ValueError("WEBHOOK_SECRET не установлен!")
+if BOT_MODE == "webhook" and WEBHOOK_SET_ON_STARTUP and not WEBHOOK_BASE_URL:
+    raise ValueError("WEBHOOK_BASE_URL не установлен!")
 
 print(f"✅ Настройки загружены для окружения: {ENVIRONMENT}")
 
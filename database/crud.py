@@ -1,17 +1,44 @@
 """
 Функции для работы с базой данных.
+
+Функции не коммитят: транзакцией управляет вызывающий код (DbSessionMiddleware
+для апдейтов, сами задачи планировщика и фоновые сервисы). Дневная статистика
+в памяти обновляется только после commit (database.after_commit).
 """
-import json
-from sqlalchemy import select
+from collections import Counter
+from functools import partial
+from sqlalchemy import Row, bindparam, case, func, insert, literal, null, or_, select, update
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.ext.asyncio import AsyncSession
-from database.models import User, Quest, ChatHistory
-from datetime import datetime
+from database.database import after_commit
+from database.models import User, Quest, ChatHistory, DailyStat, UserActivity
+from datetime import date, datetime
 from typing import Optional
-from services.ai_service import generate_daily_quest, generate_weekly_quest
-from services.level_service import get_level_from_experience
+from services.level_service import get_level_from_experience, calculate_task_exp
 from datetime import timedelta
+from services.user_cache_service import CachedUser, user_cache
+from services.stats_service import stats_rollup
+from services.expiry_service import quest_expiry
+from config.settings import (
+    QUEST_DAILY_HOURS,
+    QUEST_WEEKLY_HOURS,
+    DATABASE_TYPE,
+    DEFAULT_TIMEZONE,
+    DEFAULT_DELIVERY_HOUR,
+    DELIVERY_JITTER_MINUTES,
+)
+from utils import metrics
 from utils.logger import logger
 
+# INSERT с поддержкой ON CONFLICT для текущей СУБД
+upsert_insert = postgresql.insert if DATABASE_TYPE == "postgresql" else sqlite.insert
+
+# Как часто можно получать квест каждого типа
+QUEST_COOLDOWNS = {
+    "daily": timedelta(hours=24),
+    "weekly": timedelta(days=7),
+}
+
 
 # ========== USERS ==========
 
@@ -20,24 +47,32 @@ async def get_or_create_user(
     telegram_id: int,
     username: Optional[str],
     first_name: str
-) -> User:
+) -> CachedUser:
+
+    # Быстрый путь: пользователь в кэше и профиль не поменялся
+    cached = user_cache.get(telegram_id)
+    if cached and cached.username == username and cached.first_name == first_name:
+        metrics.increment("user_cache_hits")
+        after_commit(session, partial(stats_rollup.mark_active, cached.id))
+        return cached
+
+    metrics.increment("user_cache_misses")
 
-    # Ищем пользователя
+    # Один запрос: создаем пользователя или обновляем имя, если оно поменялось
+    started_at = datetime.utcnow()
     result = await session.execute(
-        select(User).where(User.telegram_id == telegram_id)
+        upsert_insert(User)
+        .values(telegram_id=telegram_id, username=username, first_name=first_name)
+        .on_conflict_do_update(
+            index_elements=[User.telegram_id],
+            set_={"username": username, "first_name": first_name}
+        )
+        .returning(User.id, User.created_at)
     )
-    user = result.scalar_one_or_none()
+    user_id, created_at = result.one()
 
-    # Если не нашли - создаем
-    if not user:
-        user = User(
-            telegram_id=telegram_id,
-            username=username,
-            first_name=first_name
-        )
-        session.add(user)
-        await session.commit()
-        await session.refresh(user)
+    if created_at >= started_at:
+        after_commit(session, partial(stats_rollup.add, new_users=1))
         logger.info(
             'Создан новый пользователь',
             telegram_id=telegram_id,
@@ -45,6 +80,16 @@ async def get_or_create_user(
             first_name=first_name
         )
 
+    user = CachedUser(
+        id=user_id,
+        telegram_id=telegram_id,
+        username=username,
+        first_name=first_name
+    )
+    user_cache.put(user)
+    metrics.set_gauge("user_cache_size", len(user_cache))
+    after_commit(session, partial(stats_rollup.mark_active, user_id))
+
     return user
 
 
@@ -59,6 +104,75 @@ async def get_user_by_telegram_id(
     return result.scalar_one_or_none()
 
 
+async def set_user_timezone(session: AsyncSession, user_id: int, timezone: str):
+    await session.execute(
+        update(User).where(User.id == user_id).values(timezone=timezone)
+    )
+
+
+async def set_user_delivery_hour(session: AsyncSession, user_id: int, delivery_hour: int):
+    await session.execute(
+        update(User).where(User.id == user_id).values(delivery_hour=delivery_hour)
+    )
+
+
+def _due_condition(due: dict[tuple[int, int], list[str]]):
+    """
+    Пользователи, у которых сейчас час рассылки. due: (час, минута) местного
+    времени -> пояса, где сейчас это время. NULL в timezone/delivery_hour
+    означает значение по умолчанию; условия без coalesce, чтобы работал
+    индекс ix_users_timezone_delivery_hour.
+    """
+    conditions = []
+    for (hour, minute), timezones in due.items():
+        zone_match = User.timezone.in_(timezones)
+        if DEFAULT_TIMEZONE in timezones:
+            zone_match = zone_match | User.timezone.is_(None)
+
+        hour_match = User.delivery_hour == hour
+        if hour == DEFAULT_DELIVERY_HOUR:
+            hour_match = hour_match | User.delivery_hour.is_(None)
+
+        condition = zone_match & hour_match
+        if DELIVERY_JITTER_MINUTES:
+            # Сдвиг внутри часа уже наступил
+            condition = condition & (User.id % DELIVERY_JITTER_MINUTES <= minute)
+        conditions.append(condition)
+
+    return or_(*conditions)
+
+
+async def get_users_page_for_quest(
+    session: AsyncSession,
+    quest_type: str,
+    after_id: int,
+    limit: int,
+    due: Optional[dict[tuple[int, int], list[str]]] = None
+) -> list[Row]:
+    """
+    Страница пользователей (id > after_id), которым можно выдать квест.
+    Только id, telegram_id, first_name; пользователи на кулдауне
+    отсекаются тем же запросом.
+
+    С due - только пользователи, у которых сейчас час рассылки и чей сдвиг
+    внутри часа (id % DELIVERY_JITTER_MINUTES) уже наступил (см. _due_condition).
+    """
+    cutoff_time = datetime.utcnow() - QUEST_COOLDOWNS[quest_type]
+    last_issued = _last_issued_column(quest_type)
+
+    query = (
+        select(User.id, User.telegram_id, User.first_name)
+        .where(User.id > after_id)
+        .where((last_issued.is_(None)) | (last_issued <= cutoff_time))
+    )
+
+    if due is not None:
+        query = query.where(_due_condition(due))
+
+    result = await session.execute(query.order_by(User.id).limit(limit))
+    return list(result.all())
+
+
 # ========== QUESTS ==========
 
 async def create_quest(
@@ -71,22 +185,65 @@ async def create_quest(
     quest_type: str
 ) -> Quest:
 
+    created_at = datetime.utcnow()
     quest = Quest(
         user_id=user_id,
         title=title,
         description=description,
-        tasks=json.dumps(tasks, ensure_ascii=False),  # Сохраняем как JSON строку
-        completed_tasks='[]',
+        tasks=tasks,
+        task_count=len(tasks),
+        completed_mask=0,
         difficulty=difficulty,
         quest_type=quest_type,
-        status="pending"
+        status="pending",
+        created_at=created_at,
+        expires_at=created_at + get_quest_duration(quest_type)
     )
     session.add(quest)
-    await session.commit()
-    await session.refresh(quest)
+    await session.execute(
+        update(User)
+        .where(User.id == user_id)
+        .values({
+            User.quests_total: User.quests_total + 1,
+            _last_issued_column(quest_type): created_at
+        })
+    )
+    await session.flush()
+
+    after_commit(session, partial(quest_expiry.schedule, quest.id, quest.expires_at))
+    after_commit(session, partial(stats_rollup.add, quest_type, difficulty, quests_issued=1))
     return quest
 
 
+def get_quest_duration(quest_type: str) -> timedelta:
+    """
+    Сколько живет квест до провала (из QUEST_DAILY_HOURS/QUEST_WEEKLY_HOURS).
+    """
+    if quest_type == "daily":
+        return timedelta(hours=QUEST_DAILY_HOURS)
+    return timedelta(hours=QUEST_WEEKLY_HOURS)
+
+
+async def get_pending_quest_deadlines(
+    session: AsyncSession,
+    until: Optional[datetime] = None
+) -> list[tuple[int, datetime]]:
+    """
+    (id, expires_at) активных квестов - для загрузки таймера истечения.
+    С until - только истекающие не позже until.
+    """
+    query = (
+        select(Quest.id, Quest.expires_at)
+        .where(Quest.status == "pending")
+        .where(Quest.expires_at.is_not(None))
+    )
+    if until is not None:
+        query = query.where(Quest.expires_at <= until)
+
+    result = await session.execute(query)
+    return [tuple(row) for row in result.all()]
+
+
 async def get_user_quests(
     session: AsyncSession,
     user_id: int,
@@ -112,11 +269,20 @@ async def complete_quest(
     )
     quest = result.scalar_one()
 
-    quest.status = "completed"
-    quest.completed_at = datetime.utcnow()
+    if quest.status == "pending":
+        quest.status = "completed"
+        quest.completed_at = datetime.utcnow()
+        await session.execute(
+            update(User)
+            .where(User.id == quest.user_id)
+            .values(quests_completed=User.quests_completed + 1)
+        )
+        after_commit(session, partial(quest_expiry.cancel, quest.id))
+        after_commit(session, partial(
+            stats_rollup.add, quest.quest_type, quest.difficulty, quests_completed=1
+        ))
 
-    await session.commit()
-    await session.refresh(quest)
+    await session.flush()
     return quest
 
 
@@ -130,29 +296,130 @@ async def fail_quest(
     )
     quest = result.scalar_one()
 
-    quest.status = "failed"
+    if quest.status == "pending":
+        quest.status = "failed"
+        await add_failed_quests(session, [quest.user_id])
+        after_commit(session, partial(quest_expiry.cancel, quest.id))
+        after_commit(session, partial(
+            stats_rollup.add, quest.quest_type, quest.difficulty, quests_failed=1
+        ))
 
-    await session.commit()
-    await session.refresh(quest)
+    await session.flush()
     return quest
 
 
-# ========== CHAT HISTORY ==========
+async def add_failed_quests(session: AsyncSession, user_ids: list[int]):
+    """
+    Увеличивает счетчик проваленных квестов (user_id может повторяться).
+    """
+    failed_by_user = Counter(user_ids)
+    if not failed_by_user:
+        return
+
+    users = User.__table__
+    await session.execute(
+        update(users)
+        .where(users.c.id == bindparam("target_id"))
+        .values(quests_failed=users.c.quests_failed + bindparam("failed")),
+        [
+            {"target_id": user_id, "failed": failed}
+            for user_id, failed in failed_by_user.items()
+        ]
+    )
+
+
+async def count_quests_by_status(session: AsyncSession) -> dict[int, dict[str, int]]:
+    """
+    Считает квесты каждого пользователя по статусам одним GROUP BY.
+    """
+    result = await session.execute(
+        select(
+            Quest.user_id,
+            func.count(),
+            func.count().filter(Quest.status == "completed"),
+            func.count().filter(Quest.status == "failed")
+        ).group_by(Quest.user_id)
+    )
+    return {
+        user_id: {"total": total, "completed": completed, "failed": failed}
+        for user_id, total, completed, failed in result.all()
+    }
+
 
-async def save_message(
+def get_user_quest_stats(user: User) -> dict[str, int]:
+    """
+    Статистика квестов из счетчиков пользователя - без запросов к quests.
+    """
+    return {
+        "total": user.quests_total,
+        "completed": user.quests_completed,
+        "failed": user.quests_failed,
+        "pending": user.quests_total - user.quests_completed - user.quests_failed,
+    }
+
+
+# ========== DAILY STATS ==========
+
+DAILY_STAT_COUNTERS = (
+    "new_users",
+    "level_ups",
+    "quests_issued",
+    "quests_completed",
+    "quests_failed",
+    "exp_granted",
+)
+
+
+async def save_daily_stats(
     session: AsyncSession,
-    user_id: int,
-    message_text: str,
-    is_from_user: bool
+    deltas: dict[tuple[date, str, str], dict[str, int]]
 ):
+    """
+    Прибавляет приращения к строкам daily_stats (upsert по дню/типу/сложности).
+    """
+    if not deltas:
+        return
+
+    table = DailyStat.__table__
+    stmt = upsert_insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.day, table.c.quest_type, table.c.difficulty],
+        set_={name: table.c[name] + stmt.excluded[name] for name in DAILY_STAT_COUNTERS}
+    )
 
-    chat_entry = ChatHistory(
-        user_id=user_id,
-        message_text=message_text,
-        is_from_user=is_from_user
+    rows = [
+        {
+            "day": day,
+            "quest_type": quest_type,
+            "difficulty": difficulty,
+            **{name: increments.get(name, 0) for name in DAILY_STAT_COUNTERS}
+        }
+        for (day, quest_type, difficulty), increments in deltas.items()
+    ]
+    await session.execute(stmt, rows)
+
+
+async def save_user_activity(session: AsyncSession, active: set[tuple[date, int]]):
+    if not active:
+        return
+
+    table = UserActivity.__table__
+    await session.execute(
+        upsert_insert(table).on_conflict_do_nothing(),
+        [{"day": day, "user_id": user_id} for day, user_id in active]
     )
-    session.add(chat_entry)
-    await session.commit()
+
+
+# ========== CHAT HISTORY ==========
+
+async def save_messages(
+    session: AsyncSession,
+    entries: list[dict]
+):
+    """
+    Записывает пачку сообщений одним многострочным INSERT.
+    """
+    await session.execute(insert(ChatHistory), entries)
 
 
 async def get_user_chat_history(
@@ -172,22 +439,16 @@ async def get_user_chat_history(
 
 async def create_ai_quest_for_user(
     session: AsyncSession,
-    user: User,
-    quest_type: str  # "daily" или "weekly"
+    user: User | CachedUser,
+    quest_type: str,  # "daily" или "weekly"
+    quest_data: dict
 ) -> Quest:
-    logger.debug(
-        'Генерация AI квеста',
-        user_id=user.id,
-        quest_type=quest_type
-    )
-
-    # Генерируем квест через AI
-    if quest_type == "daily":
-        quest_data = generate_daily_quest(user_name=user.first_name)
-    else:
-        quest_data = generate_weekly_quest(user_name=user.first_name)
+    """
+    Сохраняет квест, полученный из get_quest_data.
 
-    # Создаем квест в БД
+    Сам запрос к AI делается до вызова и вне транзакции: вызывающий код
+    коммитит чтение перед генерацией, чтобы соединение вернулось в пул.
+    """
     quest = await create_quest(
         session=session,
         user_id=user.id,
@@ -225,46 +486,46 @@ async def get_active_quest_by_type(
     return result.scalar_one_or_none()
 
 
-async def check_can_generate_quest(
+def _last_issued_column(quest_type: str):
+    return getattr(User, f"last_{quest_type}_issued_at")
+
+
+async def reserve_quest_slot(
     session: AsyncSession,
     user_id: int,
     quest_type: str
-) -> tuple[bool, str]:
-
-    # Определяем период проверки
+) -> tuple[Optional[datetime], str]:
+    """
+    Проверяет кулдаун и сразу занимает слот одним условным UPDATE, поэтому
+    две одновременные генерации не пройдут проверку обе. Возвращает
+    (время резерва, "") или (None, сообщение для пользователя).
+    Если квест так и не создан, слот нужно вернуть через release_quest_slot.
+    """
+    time_period = QUEST_COOLDOWNS[quest_type]
     if quest_type == "daily":
-        time_period = timedelta(hours=24)
         quest_name = "ежедневный квест"
     else:
-        time_period = timedelta(days=7)
         quest_name = "недельный квест"
 
-    # Ищем ЛЮБЫЕ квесты этого типа за период (и активные, и выполненные)
-    cutoff_time = datetime.utcnow() - time_period
+    last_issued = _last_issued_column(quest_type)
+    now = datetime.utcnow()
 
     result = await session.execute(
-        select(Quest)
-        .where(Quest.user_id == user_id)
-        .where(Quest.quest_type == quest_type)
-        .where(Quest.created_at >= cutoff_time)
-        .order_by(Quest.created_at.desc())
-        .limit(1)
+        update(User)
+        .where(User.id == user_id)
+        .where((last_issued.is_(None)) | (last_issued <= now - time_period))
+        .values({last_issued: now})
+        .returning(User.id)
+        .execution_options(synchronize_session=False)
     )
-    last_quest = result.scalar_one_or_none()
-
-    if not last_quest:
-        # Квестов за этот период нет - можно создавать
-        return True, ""
+    if result.scalar_one_or_none() is not None:
+        return now, ""
 
-    # Рассчитываем когда можно будет взять новый квест
-    next_available = last_quest.created_at + time_period
-    time_left = next_available - datetime.utcnow()
+    # Квест еще нельзя взять - считаем, сколько ждать
+    result = await session.execute(select(last_issued).where(User.id == user_id))
+    last_issued_at = result.scalar_one_or_none() or now
 
-    if time_left.total_seconds() <= 0:
-        # Время прошло - можно создавать
-        return True, ""
-
-    # Квест еще нельзя взять
+    time_left = last_issued_at + time_period - now
     hours_left = int(time_left.total_seconds() // 3600)
     minutes_left = int((time_left.total_seconds() % 3600) // 60)
 
@@ -276,69 +537,103 @@ async def check_can_generate_quest(
         f"{'сутки' if quest_type == 'daily' else '7 дней'}!"
     )
 
-    return False, message
+    return None, message
+
+
+async def release_quest_slot(
+    session: AsyncSession,
+    user_id: int,
+    quest_type: str,
+    reserved_at: datetime
+):
+    """
+    Возвращает слот, занятый reserve_quest_slot, если квест не удалось создать.
+    Резерв уже был возможен, значит, прошлый квест старше кулдауна - NULL
+    ведет себя так же.
+    """
+    last_issued = _last_issued_column(quest_type)
+    await session.execute(
+        update(User)
+        .where(User.id == user_id)
+        .where(last_issued == reserved_at)
+        .values({last_issued: None})
+        .execution_options(synchronize_session=False)
+    )
 
-async def toggle_task_completion(
+async def complete_task(
     session: AsyncSession,
     quest_id: int,
+    telegram_id: int,
     task_index: int
-) -> Quest:
+) -> Optional[tuple[Quest, User, int, int, bool]]:
+    """
+    Отмечает задание выполненным и начисляет опыт (в транзакции вызывающего).
+
+    UPDATE квеста проходит только если квест принадлежит пользователю,
+    еще активен и задание не было отмечено - поэтому двойное нажатие не
+    начислит опыт дважды. Возвращает (квест, пользователь, опыт за задание,
+    бонус за квест, был ли level up) или None, если отметить нельзя.
+    """
+    bit = 1 << task_index
+    new_mask = Quest.completed_mask.op("|")(bit)
+    all_completed = new_mask == literal(1).op("<<")(Quest.task_count) - 1
+    owner_id = select(User.id).where(User.telegram_id == telegram_id).scalar_subquery()
 
     result = await session.execute(
-        select(Quest).where(Quest.id == quest_id)
+        update(Quest)
+        .where(Quest.id == quest_id)
+        .where(Quest.user_id == owner_id)
+        .where(Quest.status == "pending")
+        .where(Quest.task_count > task_index)
+        .where(Quest.completed_mask.op("&")(bit) == 0)
+        .values(
+            completed_mask=new_mask,
+            status=case((all_completed, "completed"), else_="pending"),
+            completed_at=case((all_completed, datetime.utcnow()), else_=null())
+        )
+        .returning(Quest)
+        .execution_options(populate_existing=True)
     )
-    quest = result.scalar_one()
-
-    # Парсим список выполненных заданий
-    completed = json.loads(quest.completed_tasks)
-
-    # Переключаем статус
-    if task_index in completed:
-        completed.remove(task_index)  # Убираем из выполненных
-    else:
-        completed.append(task_index)  # Добавляем в выполненные
+    quest = result.scalar_one_or_none()
 
-    # Сохраняем обратно
-    quest.completed_tasks = json.dumps(completed)
-
-    # Проверяем все ли задания выполнены
-    tasks = json.loads(quest.tasks)
-    if len(completed) == len(tasks):
-        quest.status = "completed"
-        quest.completed_at = datetime.utcnow()
-    else:
-        quest.status = "pending"
-        quest.completed_at = None
+    if quest is None:
+        return None
 
-    await session.commit()
-    await session.refresh(quest)
-
-    return quest
-
-async def add_experience(
-    session: AsyncSession,
-    user_id: int,
-    exp_amount: int
-) -> tuple[User, bool, int]:
+    quest_completed = quest.status == "completed"
+    task_exp, bonus_exp = calculate_task_exp(quest.quest_type, quest_completed)
 
     result = await session.execute(
-        select(User).where(User.id == user_id)
+        update(User)
+        .where(User.id == quest.user_id)
+        .values(
+            experience=User.experience + task_exp + bonus_exp,
+            quests_completed=User.quests_completed + int(quest_completed)
+        )
+        .returning(User)
+        .execution_options(populate_existing=True)
     )
     user = result.scalar_one()
 
     old_level = user.level
-    user.experience += exp_amount
-
-    # Вычисляем новый уровень
     new_level, _, _ = get_level_from_experience(user.experience)
-
     level_up = new_level > old_level
-    user.level = new_level
-
-    await session.commit()
-    await session.refresh(user)
-
     if level_up:
+        user.level = new_level
+
+    await session.flush()
+
+    if quest_completed:
+        after_commit(session, partial(quest_expiry.cancel, quest.id))
+    after_commit(session, partial(stats_rollup.mark_active, user.id))
+    after_commit(session, partial(
+        stats_rollup.add,
+        quest.quest_type,
+        quest.difficulty,
+        quests_completed=int(quest_completed),
+        exp_granted=task_exp + bonus_exp
+    ))
+    if level_up:
+        after_commit(session, partial(stats_rollup.add, level_ups=new_level - old_level))
         logger.success(
             "LEVEL UP!",
             user_id=user.id,
@@ -350,48 +645,44 @@ async def add_experience(
         logger.debug(
             "Опыт начислен",
             user_id=user.id,
-            exp_amount=exp_amount,
+            exp_amount=task_exp + bonus_exp,
             total_exp=user.experience
         )
 
-    return user, level_up, new_level
+    return quest, user, task_exp, bonus_exp, level_up
 
-async def mark_expired_quests(session) -> int:
+async def mark_expired_quests(
+    session: AsyncSession,
+    quest_ids: Optional[list[int]] = None
+) -> int:
     """
-    Помечает просроченные квесты как failed.
+    Помечает просроченные квесты как failed одним UPDATE по индексу
+    (status, expires_at). quest_ids - только эти квесты (из таймера истечения).
     Возвращает количество помеченных квестов.
     """
-    from datetime import datetime, timedelta
-    from sqlalchemy import select
-    from database.models import Quest
-    from config.settings import QUEST_DAILY_HOURS, QUEST_WEEKLY_HOURS
-    from utils.logger import logger
-
-    now = datetime.utcnow()
+    query = (
+        update(Quest)
+        .where(Quest.status == "pending")
+        .where(Quest.expires_at <= datetime.utcnow())
+    )
+    if quest_ids is not None:
+        query = query.where(Quest.id.in_(quest_ids))
 
-    # Получаем все активные квесты
     result = await session.execute(
-        select(Quest).where(Quest.status == "pending")
+        query
+        .values(status="failed")
+        .returning(Quest.id, Quest.user_id, Quest.quest_type, Quest.difficulty)
+        .execution_options(synchronize_session=False)
     )
-    quests = result.scalars().all()
-
-    expired_count = 0
-
-    for quest in quests:
-        # Вычисляем время истечения
-        if quest.quest_type == "daily":
-            expires_at = quest.created_at + timedelta(hours=QUEST_DAILY_HOURS)
-        else:  # weekly
-            expires_at = quest.created_at + timedelta(hours=QUEST_WEEKLY_HOURS)
+    expired = result.all()
 
-        # Если время вышло - помечаем как failed
-        if now > expires_at:
-            quest.status = "failed"
-            expired_count += 1
-            logger.info(
-                f'Квест просрочен: ID={quest.id}, тип={quest.quest_type}, пользователь={quest.user_id}'
-            )
+    await add_failed_quests(session, [row.user_id for row in expired])
 
-    await session.commit()
+    for row in expired:
+        after_commit(session, partial(quest_expiry.cancel, row.id))
+        after_commit(session, partial(
+            stats_rollup.add, row.quest_type, row.difficulty, quests_failed=1
+        ))
+        logger.info(f'Квест просрочен: ID={row.id}, пользователь={row.user_id}')
 
-    return expired_count
+    return len(expired)
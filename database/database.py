@@ -1,9 +1,14 @@
-from typing import Any, AsyncGenerator
+from typing import Any, AsyncGenerator, Callable
 
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker, AsyncEngine
-from database.models import Base
+from sqlalchemy.orm import Session
+from database.migrations import run_migrations
 from config.settings import get_database_url, DATABASE_TYPE
+from utils import metrics
+import json
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
@@ -12,11 +17,18 @@ logger = logging.getLogger(__name__)
 
 database_url = get_database_url()
 
+
+def _json_serializer(value) -> str:
+    # Кириллица в JSON-колонках хранится как есть, без \uXXXX
+    return json.dumps(value, ensure_ascii=False)
+
+
 # Создаём engine с учётом типа базы
 if DATABASE_TYPE == "sqlite":
     engine: AsyncEngine = create_async_engine(
         database_url,
-        echo=False
+        echo=False,
+        json_serializer=_json_serializer
     )
 else:  # PostgreSQL
     engine: AsyncEngine = create_async_engine(
@@ -24,9 +36,66 @@ else:  # PostgreSQL
         echo=False,
         pool_size=10,
         max_overflow=20,
-        pool_pre_ping=True
+        pool_pre_ping=True,
+        json_serializer=_json_serializer
     )
 
+# ========== POOL METRICS ==========
+# Сколько соединение провело вне пула: долгие значения означают, что
+# соединение держат во время сетевых вызовов (AI, Telegram)
+
+_checked_out = 0
+
+
+@event.listens_for(engine.sync_engine, "checkout")
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    global _checked_out
+    _checked_out += 1
+    connection_record.info["checkout_at"] = time.monotonic()
+    metrics.increment("db_pool_checkouts")
+    metrics.set_gauge("db_pool_checked_out", _checked_out)
+
+
+@event.listens_for(engine.sync_engine, "checkin")
+def _on_checkin(dbapi_connection, connection_record):
+    global _checked_out
+    checkout_at = connection_record.info.pop("checkout_at", None)
+    if checkout_at is None:
+        return
+
+    _checked_out -= 1
+    metrics.observe("db_pool_checkout_seconds", time.monotonic() - checkout_at)
+    metrics.set_gauge("db_pool_checked_out", _checked_out)
+
+
+# ========== AFTER COMMIT ==========
+# Побочные эффекты (счетчики в памяти, отложенная запись истории чата),
+# которые должны случиться, только если транзакция действительно закоммичена
+
+_AFTER_COMMIT_KEY = "after_commit"
+
+
+def after_commit(session: AsyncSession, callback: Callable[[], Any]) -> None:
+    """
+    Выполняет callback после успешного commit сессии. При rollback он отбрасывается.
+    """
+    session.info.setdefault(_AFTER_COMMIT_KEY, []).append(callback)
+
+
+@event.listens_for(Session, "after_commit")
+def _run_after_commit(session: Session):
+    for callback in session.info.pop(_AFTER_COMMIT_KEY, []):
+        try:
+            callback()
+        except Exception:
+            logger.exception("Ошибка в обработчике after_commit")
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _drop_after_commit(session: Session, previous_transaction):
+    session.info.pop(_AFTER_COMMIT_KEY, None)
+
+
 async_session_maker = async_sessionmaker(
     engine,
     class_=AsyncSession,
@@ -34,8 +103,7 @@ async_session_maker = async_sessionmaker(
 )
 
 async def init_db():
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+    await run_migrations(engine)
     print(f"✅ База данных инициализирована (тип: {DATABASE_TYPE})")
 
 async def get_session() -> AsyncGenerator[AsyncSession | Any, Any]:
@@ -0,0 +1,379 @@
+"""
+Версионные миграции схемы БД.
+
+Номер примененной версии хранится в таблице schema_version. Новая база
+создается через create_all и сразу помечается последней версией, существующая
+база прогоняется по всем миграциям новее своей версии. На PostgreSQL
+несколько экземпляров бота, стартующих одновременно, выполняют миграции
+по очереди под pg_advisory_lock.
+"""
+import json
+from collections import Counter, defaultdict
+from collections.abc import Awaitable, Callable
+from datetime import date
+
+from sqlalchemy import func, inspect, select, text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, AsyncSession
+
+from config.settings import DATABASE_TYPE
+from database.models import Base, Quest, User, DailyStat, UserActivity
+from utils.logger import logger
+
+# Размер пачки строк при переносе данных
+MIGRATION_BATCH_SIZE = 1000
+# Ключ pg_advisory_lock, под которым выполняются миграции
+MIGRATION_LOCK_KEY = 7_420_031
+
+
+async def _get_columns(conn: AsyncConnection, table: str) -> list[str]:
+    return await conn.run_sync(
+        lambda sync_conn: [c["name"] for c in inspect(sync_conn).get_columns(table)]
+    )
+
+
+async def _create_index(engine: AsyncEngine, name: str, table: str, columns: str):
+    """
+    Создает индекс, если его нет. На PostgreSQL - CONCURRENTLY, без блокировки
+    записи в таблицу (такой индекс нельзя строить внутри транзакции).
+    """
+    if DATABASE_TYPE != "postgresql":
+        async with engine.begin() as conn:
+            await conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})"))
+        return
+
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+
+        # Прерванный CONCURRENTLY оставляет невалидный индекс - пересоздаем его
+        result = await conn.execute(
+            text(
+                "SELECT 1 FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid "
+                "WHERE c.relname = :name AND NOT i.indisvalid"
+            ),
+            {"name": name}
+        )
+        if result.first():
+            await conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+
+        await conn.execute(
+            text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} ({columns})")
+        )
+
+
+# ========== MIGRATIONS ==========
+
+async def _add_quest_expires_at(engine: AsyncEngine):
+    """
+    Колонка добавляется в своей транзакции, а заполняется одним UPDATE
+    уже после commit: ALTER не держит блокировку таблицы на время заполнения.
+    """
+    from database.crud import get_quest_duration
+
+    async with engine.begin() as conn:
+        if "expires_at" not in await _get_columns(conn, "quests"):
+            await conn.execute(text("ALTER TABLE quests ADD COLUMN expires_at TIMESTAMP"))
+
+    if DATABASE_TYPE == "postgresql":
+        expires_at = "created_at + make_interval(secs => {seconds})"
+    else:
+        expires_at = "datetime(created_at, '+{seconds} seconds')"
+
+    durations = {
+        quest_type: int(get_quest_duration(quest_type).total_seconds())
+        for quest_type in ("daily", "weekly")
+    }
+    async with engine.begin() as conn:
+        await conn.execute(text(
+            "UPDATE quests SET expires_at = CASE quest_type "
+            f"WHEN 'daily' THEN {expires_at.format(seconds=durations['daily'])} "
+            f"ELSE {expires_at.format(seconds=durations['weekly'])} END "
+            "WHERE expires_at IS NULL"
+        ))
+
+    await _create_index(engine, "ix_quests_status_expires_at", "quests", "status, expires_at")
+
+
+async def _add_hot_query_indexes(engine: AsyncEngine):
+    await _create_index(
+        engine, "ix_quests_user_status_created", "quests", "user_id, status, created_at"
+    )
+    await _create_index(
+        engine, "ix_quests_user_type_created", "quests", "user_id, quest_type, created_at"
+    )
+    await _create_index(
+        engine, "ix_chat_history_user_created", "chat_history", "user_id, created_at"
+    )
+
+
+async def _store_task_completion_as_bitmask(engine: AsyncEngine):
+    """
+    completed_tasks (JSON-список индексов в тексте) -> completed_mask + task_count.
+    На PostgreSQL tasks переводится в JSONB.
+    """
+    async with engine.begin() as conn:
+        columns = await _get_columns(conn, "quests")
+
+        if "task_count" not in columns:
+            await conn.execute(text(
+                "ALTER TABLE quests ADD COLUMN task_count INTEGER NOT NULL DEFAULT 0"
+            ))
+            await conn.execute(text(
+                "ALTER TABLE quests ADD COLUMN completed_mask INTEGER NOT NULL DEFAULT 0"
+            ))
+
+        if "completed_tasks" in columns:
+            last_id = 0
+            while True:
+                result = await conn.execute(
+                    text(
+                        "SELECT id, tasks, completed_tasks FROM quests "
+                        "WHERE id > :last_id ORDER BY id LIMIT :limit"
+                    ),
+                    {"last_id": last_id, "limit": MIGRATION_BATCH_SIZE}
+                )
+                rows = result.all()
+                if not rows:
+                    break
+
+                params = []
+                for quest_id, tasks, completed_tasks in rows:
+                    task_count = len(_load_json_list(tasks))
+                    completed_mask = 0
+                    for index in _load_json_list(completed_tasks):
+                        if isinstance(index, int) and 0 <= index < task_count:
+                            completed_mask |= 1 << index
+                    params.append({
+                        "quest_id": quest_id,
+                        "task_count": task_count,
+                        "completed_mask": completed_mask
+                    })
+
+                await conn.execute(
+                    text(
+                        "UPDATE quests SET task_count = :task_count, "
+                        "completed_mask = :completed_mask WHERE id = :quest_id"
+                    ),
+                    params
+                )
+                last_id = rows[-1][0]
+
+            await conn.execute(text("ALTER TABLE quests DROP COLUMN completed_tasks"))
+
+        if DATABASE_TYPE == "postgresql":
+            await conn.execute(text(
+                "ALTER TABLE quests ALTER COLUMN tasks TYPE JSONB USING tasks::jsonb"
+            ))
+
+
+async def _add_user_quest_counters(engine: AsyncEngine):
+    from database.crud import count_quests_by_status
+
+    async with engine.begin() as conn:
+        if "quests_total" not in await _get_columns(conn, "users"):
+            for column in ("quests_total", "quests_completed", "quests_failed"):
+                await conn.execute(text(
+                    f"ALTER TABLE users ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0"
+                ))
+
+    async with AsyncSession(engine) as session:
+        counts = await count_quests_by_status(session)
+        if counts:
+            await session.execute(
+                text(
+                    "UPDATE users SET quests_total = :total, quests_completed = :completed, "
+                    "quests_failed = :failed WHERE id = :user_id"
+                ),
+                [{"user_id": user_id, **values} for user_id, values in counts.items()]
+            )
+        await session.commit()
+
+
+async def _add_daily_stats(engine: AsyncEngine):
+    """
+    Таблицы daily_stats/user_activity и заполнение агрегатов по истории.
+    Уровни и опыт по дням не восстановить - они относятся ко дню регистрации.
+    """
+    from database.crud import save_daily_stats
+
+    async with engine.begin() as conn:
+        await conn.run_sync(lambda sync_conn: DailyStat.__table__.create(sync_conn, checkfirst=True))
+        await conn.run_sync(lambda sync_conn: UserActivity.__table__.create(sync_conn, checkfirst=True))
+
+        result = await conn.execute(select(func.count()).select_from(DailyStat))
+        if result.scalar():
+            return
+
+    deltas: dict[tuple[date, str, str], Counter] = defaultdict(Counter)
+
+    async with AsyncSession(engine) as session:
+        result = await session.execute(
+            select(
+                func.date(User.created_at),
+                func.count(),
+                func.sum(User.level - 1),
+                func.sum(User.experience)
+            ).group_by(func.date(User.created_at))
+        )
+        for day, new_users, level_ups, experience in result.all():
+            deltas[(_to_date(day), "", "")].update(
+                new_users=new_users,
+                level_ups=level_ups or 0,
+                exp_granted=experience or 0
+            )
+
+        sources = (
+            ("quests_issued", Quest.created_at, None),
+            ("quests_completed", Quest.completed_at, "completed"),
+            ("quests_failed", Quest.expires_at, "failed"),
+        )
+        for counter, day_column, status in sources:
+            query = (
+                select(func.date(day_column), Quest.quest_type, Quest.difficulty, func.count())
+                .where(day_column.is_not(None))
+                .group_by(func.date(day_column), Quest.quest_type, Quest.difficulty)
+            )
+            if status:
+                query = query.where(Quest.status == status)
+
+            result = await session.execute(query)
+            for day, quest_type, difficulty, count in result.all():
+                deltas[(_to_date(day), quest_type, difficulty)][counter] += count
+
+        await save_daily_stats(session, deltas)
+        await session.commit()
+
+
+async def _add_user_last_issued_at(engine: AsyncEngine):
+    async with engine.begin() as conn:
+        if "last_daily_issued_at" in await _get_columns(conn, "users"):
+            return
+
+        for quest_type in ("daily", "weekly"):
+            column = f"last_{quest_type}_issued_at"
+            await conn.execute(text(f"ALTER TABLE users ADD COLUMN {column} TIMESTAMP"))
+            await conn.execute(
+                text(
+                    f"UPDATE users SET {column} = ("
+                    "SELECT MAX(created_at) FROM quests "
+                    "WHERE quests.user_id = users.id AND quests.quest_type = :quest_type)"
+                ),
+                {"quest_type": quest_type}
+            )
+
+
+async def _add_user_delivery_settings(engine: AsyncEngine):
+    async with engine.begin() as conn:
+        if "timezone" in await _get_columns(conn, "users"):
+            return
+
+        await conn.execute(text("ALTER TABLE users ADD COLUMN timezone VARCHAR(64)"))
+        await conn.execute(text("ALTER TABLE users ADD COLUMN delivery_hour INTEGER"))
+
+
+async def _add_user_delivery_index(engine: AsyncEngine):
+    await _create_index(
+        engine, "ix_users_timezone_delivery_hour", "users", "timezone, delivery_hour"
+    )
+
+
+def _to_date(value) -> date:
+    # SQLite возвращает date() строкой, PostgreSQL - объектом date
+    return value if isinstance(value, date) else date.fromisoformat(value)
+
+
+def _load_json_list(value) -> list:
+    if isinstance(value, list):
+        return value
+    try:
+        loaded = json.loads(value or "[]")
+    except ValueError:
+        return []
+    return loaded if isinstance(loaded, list) else []
+
+
+# (версия, описание, функция). Версии только растут, старые миграции не меняются.
+MIGRATIONS: list[tuple[int, str, Callable[[AsyncEngine], Awaitable[None]]]] = [
+    (1, "quests.expires_at", _add_quest_expires_at),
+    (2, "индексы для частых запросов по квестам и истории чата", _add_hot_query_indexes),
+    (3, "выполнение заданий как битовая маска", _store_task_completion_as_bitmask),
+    (4, "счетчики квестов пользователя", _add_user_quest_counters),
+    (5, "дневные агрегаты для админской статистики", _add_daily_stats),
+    (6, "users.last_daily_issued_at/last_weekly_issued_at", _add_user_last_issued_at),
+    (7, "часовой пояс и час рассылки пользователя", _add_user_delivery_settings),
+    (8, "индекс users по поясу и часу рассылки", _add_user_delivery_index),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+async def _get_schema_version(conn: AsyncConnection):
+    await conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_version ("
+        "version INTEGER PRIMARY KEY, "
+        "applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"
+    ))
+    result = await conn.execute(text("SELECT MAX(version) FROM schema_version"))
+    return result.scalar()
+
+
+async def _set_schema_version(conn: AsyncConnection, version: int):
+    await conn.execute(
+        text("INSERT INTO schema_version (version) VALUES (:version)"),
+        {"version": version}
+    )
+
+
+async def run_migrations(engine: AsyncEngine):
+    """
+    Приводит схему БД к последней версии.
+    """
+    if DATABASE_TYPE != "postgresql":
+        await _migrate(engine)
+        return
+
+    # Блокировка сессионная: держим ее на отдельном соединении, пока миграции
+    # идут через свои. Версия схемы читается уже под блокировкой, поэтому
+    # экземпляр, дождавшийся очереди, не повторяет примененные миграции.
+    async with engine.connect() as lock_conn:
+        lock_conn = await lock_conn.execution_options(isolation_level="AUTOCOMMIT")
+        await lock_conn.execute(
+            text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATION_LOCK_KEY}
+        )
+        try:
+            await _migrate(engine)
+        finally:
+            await lock_conn.execute(
+                text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATION_LOCK_KEY}
+            )
+
+
+async def _migrate(engine: AsyncEngine):
+    async with engine.begin() as conn:
+        current_version = await _get_schema_version(conn)
+
+        if current_version is None:
+            has_tables = await conn.run_sync(
+                lambda sync_conn: inspect(sync_conn).has_table("users")
+            )
+            await conn.run_sync(Base.metadata.create_all)
+
+            if not has_tables:
+                # Новая база: create_all уже создал актуальную схему
+                await _set_schema_version(conn, LATEST_VERSION)
+                logger.info('Создана новая схема БД', version=LATEST_VERSION)
+                return
+
+            # База создана до появления миграций
+            current_version = 0
+
+    for version, description, migration in MIGRATIONS:
+        if version <= current_version:
+            continue
+
+        logger.info(f'Применяется миграция {version}: {description}')
+        await migration(engine)
+
+        async with engine.begin() as conn:
+            await _set_schema_version(conn, version)
+
+    logger.info('Схема БД актуальна', version=LATEST_VERSION)
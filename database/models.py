@@ -1,5 +1,6 @@
-from datetime import datetime
-from sqlalchemy import String, Integer, DateTime, Boolean, ForeignKey, Text, BigInteger
+from datetime import date, datetime
+from sqlalchemy import Date, String, Integer, DateTime, Boolean, ForeignKey, Text, BigInteger, Index, JSON
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 from typing import Optional
 
@@ -15,34 +16,63 @@ class User(Base):
     first_name: Mapped[str] = mapped_column(String(255), nullable=False)
     level: Mapped[int] = mapped_column(Integer, default=1)
     experience: Mapped[int] = mapped_column(Integer, default=0)
+    # Счетчики квестов для /stats, обновляются вместе со сменой статуса квеста
+    quests_total: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    quests_completed: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    quests_failed: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    # Когда выдан последний квест каждого типа - для проверки кулдауна без скана quests
+    last_daily_issued_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    last_weekly_issued_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    # Настройки рассылки; NULL - значения по умолчанию из настроек
+    timezone: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
+    delivery_hour: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
 
     # Связи
     quests: Mapped[list["Quest"]] = relationship(back_populates="user")
     chat_history: Mapped[list["ChatHistory"]] = relationship(back_populates="user")
 
+    __table_args__ = (
+        Index("ix_users_timezone_delivery_hour", "timezone", "delivery_hour"),
+    )
+
     def __repr__(self):
         return f"<User {self.telegram_id} - {self.first_name}>"
 
 class Quest(Base):
     """Модель квеста."""
     __tablename__ = "quests"
+    __table_args__ = (
+        Index("ix_quests_status_expires_at", "status", "expires_at"),
+        Index("ix_quests_user_status_created", "user_id", "status", "created_at"),
+        Index("ix_quests_user_type_created", "user_id", "quest_type", "created_at"),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), nullable=False)
     title: Mapped[str] = mapped_column(String(500), nullable=False)
     description: Mapped[str] = mapped_column(Text, nullable=False)
-    tasks: Mapped[str] = mapped_column(Text, nullable=False)
-    completed_tasks: Mapped[str] = mapped_column(Text, default=[""])
+    tasks: Mapped[list[str]] = mapped_column(JSON().with_variant(JSONB(), "postgresql"), nullable=False)
+    task_count: Mapped[int] = mapped_column(Integer, nullable=False)
+    # Бит i выставлен - задание i выполнено
+    completed_mask: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
     difficulty: Mapped[str] = mapped_column(String(50), nullable=False)
     quest_type: Mapped[str] = mapped_column(String(50), nullable=False)
     status: Mapped[str] = mapped_column(String(50), default="pending")
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
     completed_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    expires_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
 
     # Связи
     user: Mapped["User"] = relationship(back_populates="quests")
 
+    @property
+    def completed_indices(self) -> list[int]:
+        return [i for i in range(self.task_count) if self.completed_mask >> i & 1]
+
+    def is_task_completed(self, task_index: int) -> bool:
+        return bool(self.completed_mask >> task_index & 1)
+
     def __repr__(self):
         return f"<Quest {self.id} - {self.title} ({self.status})>"
 
@@ -50,6 +80,9 @@ class Quest(Base):
 class ChatHistory(Base):
     """Модель истории чата."""
     __tablename__ = "chat_history"
+    __table_args__ = (
+        Index("ix_chat_history_user_created", "user_id", "created_at"),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), nullable=False)
@@ -63,3 +96,36 @@ class ChatHistory(Base):
     def __repr__(self):
         sender = "User" if self.is_from_user else "Bot"
         return f"<ChatHistory {self.id} - {sender}>"
+
+
+class DailyStat(Base):
+    """
+    Дневные агрегаты для админской статистики.
+    Пользовательские метрики (new_users, level_ups) пишутся в строку
+    с пустыми quest_type и difficulty.
+    """
+    __tablename__ = "daily_stats"
+
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    quest_type: Mapped[str] = mapped_column(String(50), primary_key=True, default="")
+    difficulty: Mapped[str] = mapped_column(String(50), primary_key=True, default="")
+    new_users: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    level_ups: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    quests_issued: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    quests_completed: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    quests_failed: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    exp_granted: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+
+    def __repr__(self):
+        return f"<DailyStat {self.day} {self.quest_type}/{self.difficulty}>"
+
+
+class UserActivity(Base):
+    """Отметка, что пользователь был активен в этот день (для DAU)."""
+    __tablename__ = "user_activity"
+
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), primary_key=True)
+
+    def __repr__(self):
+        return f"<UserActivity {self.day} {self.user_id}>"
@@ -1,10 +1,112 @@
 import asyncio
+import signal
 from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
 from utils.logger import logger
-from config.settings import BOT_TOKEN, DATABASE_TYPE
+from config.settings import (
+    BOT_TOKEN,
+    DATABASE_TYPE,
+    BOT_MODE,
+    WEBHOOK_BASE_URL,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET,
+    WEBHOOK_HOST,
+    WEBHOOK_PORT,
+    WEBHOOK_SET_ON_STARTUP,
+    SCHEDULER_ENABLED,
+    UPDATES_CONCURRENCY_LIMIT,
+    THROTTLE_LIMITS,
+)
 from bot.handlers import basic, admin, admin_handlers
-from database.database import init_db
+from bot.middlewares.db_session import DbSessionMiddleware
+from bot.middlewares.throttling import ThrottlingMiddleware
+from bot.middlewares.user_lock import UserLockMiddleware
+from database.database import init_db, async_session_maker
 from services.scheduler_service import setup_scheduler
+from services.chat_history_service import chat_history_buffer
+from services.stats_service import stats_rollup
+from services.expiry_service import quest_expiry
+from services.llm_cache_service import llm_cache
+
+
+def create_dispatcher() -> Dispatcher:
+    """
+    Диспетчер с роутерами - общий для polling и webhook.
+    """
+    dp = Dispatcher()
+
+    # Флуд отсекается до очереди пользователя и до БД
+    dp.update.outer_middleware(ThrottlingMiddleware(THROTTLE_LIMITS))
+    # Апдейты одного пользователя - по очереди, разных - параллельно
+    dp.update.outer_middleware(UserLockMiddleware(UPDATES_CONCURRENCY_LIMIT))
+    # Одна сессия и одна транзакция на апдейт (после замка пользователя)
+    dp.update.outer_middleware(DbSessionMiddleware(async_session_maker))
+
+    # Подключение роутеров
+    dp.include_router(basic.router)
+    dp.include_router(admin.router)
+    dp.include_router(admin_handlers.router)
+
+    return dp
+
+
+async def run_polling(bot: Bot, dp: Dispatcher):
+    await bot.delete_webhook(drop_pending_updates=True)
+    await dp.start_polling(bot)
+
+
+async def run_webhook(bot: Bot, dp: Dispatcher):
+    """
+    Принимает апдейты через aiohttp-сервер. Запросы без верного
+    X-Telegram-Bot-Api-Secret-Token отклоняются.
+    """
+    app = web.Application()
+
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=WEBHOOK_SECRET
+    ).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+
+    # Проверка живости для балансировщика
+    async def healthz(request: web.Request) -> web.Response:
+        return web.Response(text="ok")
+
+    app.router.add_get("/healthz", healthz)
+
+    if WEBHOOK_SET_ON_STARTUP:
+        await bot.set_webhook(
+            url=f"{WEBHOOK_BASE_URL.rstrip('/')}{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=dp.resolve_used_update_types(),
+            drop_pending_updates=True
+        )
+        logger.info("🔗 Вебхук зарегистрирован")
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host=WEBHOOK_HOST, port=WEBHOOK_PORT)
+    await site.start()
+    logger.info(f"🌐 Webhook-сервер слушает {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+
+    # aiogram ставит обработчики сигналов только для polling. Без них SIGTERM
+    # (docker stop) убивает процесс и finally в main() - запись истории чата
+    # и статистики - не выполняется
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    try:
+        await stop_event.wait()
+        logger.info("🛑 Получен сигнал остановки")
+    finally:
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.remove_signal_handler(sig)
+        await runner.cleanup()
+
 
 async def main():
     try:
@@ -12,25 +114,27 @@ async def main():
         await init_db()
         logger.info("✅ База данных инициализирована (тип: {db_type})", db_type=DATABASE_TYPE)
 
+        # Фоновая запись истории чата
+        chat_history_buffer.start()
+
         # Создание бота и диспетчера
         bot = Bot(token=BOT_TOKEN)
-        dp = Dispatcher()
-
-        # Подключение роутеров
-        dp.include_router(basic.router)
-        dp.include_router(admin.router)
-        dp.include_router(admin_handlers.router)
+        dp = create_dispatcher()
 
-        # Настройка планировщика
-        scheduler = setup_scheduler(bot)
+        # Планировщик есть на каждом инстансе (статистика и пул квестов - в памяти
+        # процесса), рассылка и таймер истечения - только на ведущем
+        if SCHEDULER_ENABLED:
+            await quest_expiry.start()
+        scheduler = setup_scheduler(bot, leader=SCHEDULER_ENABLED)
         scheduler.start()
         logger.info("📅 Scheduler настроен")
 
-        logger.success("🤖 Бот запущен!")
+        logger.success("🤖 Бот запущен!", mode=BOT_MODE)
 
-        # Запуск polling
-        await bot.delete_webhook(drop_pending_updates=True)
-        await dp.start_polling(bot)
+        if BOT_MODE == "webhook":
+            await run_webhook(bot, dp)
+        else:
+            await run_polling(bot, dp)
 
     except Exception as e:
         logger.exception("💥 Критическая ошибка при запуске бота")
@@ -39,7 +143,13 @@ async def main():
         if 'scheduler' in locals():
             scheduler.shutdown()
             logger.info("⏹️ Scheduler остановлен")
+        await quest_expiry.stop()
+        await chat_history_buffer.stop()
+        await stats_rollup.flush()
+        if llm_cache is not None:
+            await llm_cache.close()
+        logger.info("💾 История чата и статистика записаны")
         logger.info("👋 Бот остановлен")
 
 if __name__ == '__main__':
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
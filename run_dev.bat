@@ -4,6 +4,7 @@ echo Starting DEV environment (SQLite)
 echo ========================================
 
 set ENVIRONMENT=dev
+set BOT_MODE=polling
 
 echo.
 echo Starting bot with SQLite...
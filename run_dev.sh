@@ -5,6 +5,7 @@ echo "Starting DEV environment (Linux)"
 echo "========================================"
 
 export ENVIRONMENT=dev
+export BOT_MODE=polling
 
 echo ""
 echo "[1/3] Starting PostgreSQL container..."
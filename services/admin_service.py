@@ -1,26 +1,98 @@
+import time
+from datetime import datetime, timedelta
+
 from sqlalchemy import func, select
 from sqlalchemy.ext.asyncio import AsyncSession
-from database.models import User, Quest
+from database.models import DailyStat, UserActivity
+from config.settings import ADMIN_STATS_CACHE_TTL
+
+TREND_WINDOWS = (7, 30)
+
 
 class AdminService:
+    # Снимок статистики: (время расчета, данные)
+    _snapshot: tuple[float, dict] | None = None
+
     @staticmethod
     async def get_statistics(session: AsyncSession) -> dict:
         """Получить статистику для администратора"""
 
-        result = await session.execute(select(func.count(User.id)))
-        total_users = result.scalar()
+        snapshot = AdminService._snapshot
+        if snapshot and time.monotonic() - snapshot[0] < ADMIN_STATS_CACHE_TTL:
+            return snapshot[1]
+
+        stats = await AdminService._collect_statistics(session)
+        AdminService._snapshot = (time.monotonic(), stats)
+        return stats
 
+    @staticmethod
+    async def _collect_statistics(session: AsyncSession) -> dict:
+        today = datetime.utcnow().date()
+
+        # Итоги за все время - по дневным агрегатам, без скана users/quests
         result = await session.execute(
-            select(func.count(Quest.id)).where(Quest.status == 'completed')
+            select(
+                func.coalesce(func.sum(DailyStat.new_users), 0),
+                func.coalesce(func.sum(DailyStat.quests_completed), 0),
+                func.coalesce(func.sum(DailyStat.level_ups), 0)
+            )
         )
-        completed_quests = result.scalar()
+        total_users, completed_quests, level_ups = result.one()
+
+        # Каждый пользователь начинает с 1 уровня, уровни только растут
+        avg_level = round(1 + level_ups / total_users, 1) if total_users else 0
+
+        result = await session.execute(
+            select(func.count()).where(UserActivity.day == today)
+        )
+        dau = result.scalar()
+
+        result = await session.execute(
+            select(
+                DailyStat.difficulty,
+                func.sum(DailyStat.quests_issued),
+                func.sum(DailyStat.quests_completed)
+            )
+            .where(DailyStat.difficulty != "")
+            .group_by(DailyStat.difficulty)
+        )
+        completion_by_difficulty = {
+            difficulty: round(completed / issued * 100, 1) if issued else 0.0
+            for difficulty, issued, completed in result.all()
+        }
+
+        trends = {}
+        for days in TREND_WINDOWS:
+            since = today - timedelta(days=days - 1)
+
+            result = await session.execute(
+                select(
+                    func.coalesce(func.sum(DailyStat.new_users), 0),
+                    func.coalesce(func.sum(DailyStat.quests_issued), 0),
+                    func.coalesce(func.sum(DailyStat.quests_completed), 0),
+                    func.coalesce(func.sum(DailyStat.quests_failed), 0)
+                ).where(DailyStat.day >= since)
+            )
+            new_users, issued, completed, failed = result.one()
+
+            result = await session.execute(
+                select(func.count()).where(UserActivity.day >= since)
+            )
+            active_days = result.scalar()
 
-        result = await session.execute(select(func.avg(User.level)))
-        avg_level = result.scalar()
-        avg_level = round(avg_level, 1) if avg_level else 0
+            trends[days] = {
+                'new_users': new_users,
+                'quests_issued': issued,
+                'quests_completed': completed,
+                'quests_failed': failed,
+                'avg_dau': round(active_days / days, 1)
+            }
 
         return {
             'total_users': total_users or 0,
             'completed_quests': completed_quests or 0,
-            'avg_level': avg_level
-        }
\ No newline at end of file
+            'avg_level': avg_level,
+            'dau': dau or 0,
+            'completion_by_difficulty': completion_by_difficulty,
+            'trends': trends
+        }
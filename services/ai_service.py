@@ -1,28 +1,277 @@
 """
 Сервис для генерации квестов через Yandex GPT.
 """
+import asyncio
 import openai
 import json
-import os
-
-from config.settings import YANDEX_CLOUD_API_KEY, YANDEX_CLOUD_FOLDER
+import random
+import time
+from typing import Optional
+
+from config.settings import (
+    YANDEX_CLOUD_API_KEY,
+    YANDEX_CLOUD_FOLDER,
+    AI_REQUEST_TIMEOUT,
+    AI_ATTEMPT_TIMEOUT,
+    AI_LATENCY_SLO,
+    AI_MAX_ATTEMPTS,
+    AI_BACKOFF_BASE,
+    AI_BACKOFF_MAX,
+    AI_MAX_CONCURRENT_REQUESTS,
+)
+from services.llm_cache_service import llm_cache
+from services.llm_resilience_service import llm_breaker, llm_retry_budget
+from utils import metrics
+from utils.logger import logger
 
 # Настройки Yandex Cloud
 YANDEX_CLOUD_MODEL = "yandexgpt-lite/latest"
+MODEL_URI = f"gpt://{YANDEX_CLOUD_FOLDER}/{YANDEX_CLOUD_MODEL}"
+SYSTEM_INSTRUCTIONS = "Ты - Система из аниме. Генерируй только JSON без лишнего текста."
+TEMPERATURE = 0.7
+
+# Лимит токенов ответа на один квест
+MAX_OUTPUT_TOKENS = {"daily": 500, "weekly": 700}
+# Допустимое число заданий (в промпте: 2-3 и ровно 5) - с небольшим запасом
+TASK_COUNT_LIMITS = {"daily": (2, 4), "weekly": (4, 6)}
+DIFFICULTIES = {"daily": ("easy", "medium", "hard"), "weekly": ("medium", "hard")}
+# Запросов на одну пачку, включая догенерацию невалидных квестов
+BATCH_MAX_ATTEMPTS = 3
+
+DAILY_QUEST_FORMAT = """{
+  "title": "Название квеста (3-5 слов)",
+  "description": "Вступление от Системы БЕЗ имени игрока (1-2 предложения)",
+  "tasks": [
+    "Первое задание с конкретным числом",
+    "Второе задание с конкретным числом",
+    "Третье задание (опционально)"
+  ],
+  "difficulty": "easy/medium/hard"
+}"""
 
-client = openai.OpenAI(
+WEEKLY_QUEST_FORMAT = """{
+  "title": "Название квеста (4-6 слов)",
+  "description": "Вступление от Системы БЕЗ имени игрока (2-3 предложения)",
+  "tasks": [
+    "Первое задание с метриками",
+    "Второе задание с метриками",
+    "Третье задание с метриками",
+    "Четвертое задание с метриками",
+    "Пятое задание с метриками"
+  ],
+  "difficulty": "medium/hard"
+}"""
+
+# Асинхронный клиент (httpx под капотом) - не блокирует event loop aiogram
+client = openai.AsyncOpenAI(
     api_key=YANDEX_CLOUD_API_KEY,
-    base_url="https://rest-assistant.api.cloud.yandex.net/v1"
+    base_url="https://rest-assistant.api.cloud.yandex.net/v1",
+    timeout=AI_REQUEST_TIMEOUT,
+    max_retries=0
 )
 
-def generate_daily_quest(user_name: str, user_history: str = "") -> dict:
+# Ограничение числа одновременных запросов к LLM
+_llm_semaphore = asyncio.Semaphore(AI_MAX_CONCURRENT_REQUESTS)
+
+# Сбои сервиса, после которых запрос имеет смысл повторить.
+# Остальные ошибки (400, 401 и т.п.) повтором не лечатся.
+RETRYABLE_ERRORS = (
+    TimeoutError,
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+
+async def _attempt(prompt: str, max_output_tokens: int, timeout: float, latency_slo: float):
     """
-    Генерирует ежедневный квест для пользователя.
+    Одна попытка запроса. Результат сообщается предохранителю;
+    при разомкнутом предохранителе сразу CircuitOpenError.
+    """
+    llm_breaker.before_request()
+
+    try:
+        async with _llm_semaphore:
+            started_at = time.monotonic()
+            async with asyncio.timeout(timeout):
+                response = await client.responses.create(
+                    model=MODEL_URI,
+                    temperature=TEMPERATURE,
+                    instructions=SYSTEM_INSTRUCTIONS,
+                    input=prompt,
+                    max_output_tokens=max_output_tokens
+                )
+    except RETRYABLE_ERRORS as error:
+        if isinstance(error, TimeoutError):
+            metrics.increment("llm_attempt_timeouts")
+        llm_breaker.record_failure(reason=type(error).__name__)
+        raise
+    except BaseException:
+        llm_breaker.release()
+        raise
+
+    llm_breaker.record_success(time.monotonic() - started_at, latency_slo)
+    return response
+
+
+async def _complete(prompt: str, max_output_tokens: int, quest_count: int = 1):
     """
+    Отправляет промпт в Yandex GPT и возвращает ответ модели.
+
+    Попытка ограничена AI_ATTEMPT_TIMEOUT, сбойная повторяется с
+    экспоненциальной паузой (full jitter), пока есть попытки и бюджет
+    повторов. Весь вызов вместе с паузами ограничен AI_REQUEST_TIMEOUT.
+    Таймаут и SLO масштабируются на число квестов в запросе.
+    Если задача хендлера отменена (апдейт брошен, бот остановлен),
+    CancelledError прерывает HTTP-запрос и освобождает слот.
+    """
+    attempt_timeout = AI_ATTEMPT_TIMEOUT * quest_count
+    latency_slo = AI_LATENCY_SLO * quest_count
+    llm_retry_budget.record_request()
+
+    attempt = 1
+    try:
+        async with asyncio.timeout(max(AI_REQUEST_TIMEOUT, attempt_timeout)):
+            while True:
+                try:
+                    return await _attempt(prompt, max_output_tokens, attempt_timeout, latency_slo)
+                except RETRYABLE_ERRORS as error:
+                    if attempt >= AI_MAX_ATTEMPTS or not llm_retry_budget.try_spend():
+                        raise
+
+                    delay = random.uniform(
+                        0, min(AI_BACKOFF_MAX, AI_BACKOFF_BASE * 2 ** (attempt - 1))
+                    )
+                    metrics.increment("llm_retries")
+                    logger.warning(
+                        'Повтор запроса к Yandex GPT',
+                        attempt=attempt,
+                        delay=round(delay, 2),
+                        error=repr(error)
+                    )
+                    await asyncio.sleep(delay)
+                    attempt += 1
+    except TimeoutError:
+        logger.warning(
+            'Таймаут запроса к Yandex GPT',
+            attempts=attempt,
+            timeout=AI_REQUEST_TIMEOUT
+        )
+        raise
+
+
+def _record_cost(batch_size: int, produced: int, elapsed: float, response) -> None:
+    """
+    Время и токены на один готовый квест - отдельно для каждого размера пачки,
+    чтобы по /admin_metrics выбрать AI_BATCH_SIZE.
+    """
+    if not produced:
+        return
+
+    metrics.observe(f"ai_seconds_per_quest_n{batch_size}", elapsed / produced)
+
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        metrics.observe(f"ai_tokens_per_quest_n{batch_size}", usage.total_tokens / produced)
+
+
+async def _request_quest(
+    prompt: str,
+    max_output_tokens: int,
+    quest_type: str,
+    user_id: Optional[int] = None
+) -> dict:
+    """
+    Один квест: сначала кэш ответов (вариант, который пользователь еще
+    не получал), затем модель. Ошибки кэша не мешают генерации.
+    """
+    cache_key = None
+    if llm_cache is not None:
+        cache_key = llm_cache.make_key(MODEL_URI, SYSTEM_INSTRUCTIONS, prompt, TEMPERATURE)
+        try:
+            cached = await llm_cache.get(cache_key, user_id)
+        except Exception:
+            logger.exception('Ошибка чтения кэша LLM')
+            cached = None
+        if cached is not None:
+            return cached
+
+    started_at = time.monotonic()
+    response = await _complete(prompt, max_output_tokens)
+    elapsed = time.monotonic() - started_at
+
+    quest_data = validate_quest(_parse_quest_json(response.output_text), quest_type)
+    if quest_data is None:
+        raise ValueError("Ответ модели не прошел проверку формата квеста")
+
+    _record_cost(1, 1, elapsed, response)
+
+    if cache_key is not None:
+        try:
+            await llm_cache.put(cache_key, quest_data, elapsed, user_id)
+        except Exception:
+            logger.exception('Ошибка записи в кэш LLM')
+
+    return quest_data
+
+
+def _parse_quest_json(content: str):
+    """
+    Убирает markdown-обертку из ответа модели и парсит JSON.
+    """
+    content = content.strip()
+
+    if content.startswith("```json"):
+        content = content.replace("```json", "").replace("```", "").strip()
+    if content.startswith("```"):
+        content = content.replace("```", "").strip()
+
+    return json.loads(content)
+
+
+def validate_quest(data, quest_type: str) -> Optional[dict]:
+    """
+    Проверяет квест от модели и приводит его к нормальному виду.
+    None - квест не годится (нет полей, неверное число заданий и т.п.).
+    """
+    if not isinstance(data, dict):
+        return None
+
+    title = data.get("title")
+    description = data.get("description")
+    tasks = data.get("tasks")
+    difficulty = str(data.get("difficulty", "")).strip().lower()
 
-    prompt = f"""Ты - безжалостная Система из аниме "Поднятие уровня в одиночку", которая выдает ежедневные квесты для РЕАЛЬНОЙ прокачки.
+    if not isinstance(title, str) or not title.strip():
+        return None
+    if not isinstance(description, str) or not description.strip():
+        return None
+    if not isinstance(tasks, list) or not all(isinstance(task, str) and task.strip() for task in tasks):
+        return None
 
-Создай ОДИН конкретный ежедневный квест для игрока {user_name}.
+    min_tasks, max_tasks = TASK_COUNT_LIMITS[quest_type]
+    if not min_tasks <= len(tasks) <= max_tasks:
+        return None
+    if difficulty not in DIFFICULTIES[quest_type]:
+        return None
+
+    return {
+        "title": title.strip(),
+        "description": description.strip(),
+        "tasks": [task.strip() for task in tasks],
+        "difficulty": difficulty,
+    }
+
+
+def _daily_prompt(user_name: str, user_history: str = "", count: int = 1) -> str:
+    if count == 1:
+        request_line = f"Создай ОДИН конкретный ежедневный квест для игрока {user_name}."
+    else:
+        request_line = f"Создай {count} РАЗНЫХ ежедневных квестов для игрока {user_name}."
+
+    return f"""Ты - безжалостная Система из аниме "Поднятие уровня в одиночку", которая выдает ежедневные квесты для РЕАЛЬНОЙ прокачки.
+
+{request_line}
 
 КОНЦЕПЦИЯ: Система заставляет человека становиться сильнее физически и ментально через ИЗМЕРИМЫЕ действия. Никакой абстракции - только конкретные цифры и результаты.
 
@@ -51,46 +300,19 @@ def generate_daily_quest(user_name: str, user_history: str = "") -> dict:
 
 {f"История: {user_history}" if user_history else "Первый квест новичка."}
 
-ФОРМАТ ОТВЕТА - только JSON без markdown:
-{{
-  "title": "Название квеста (3-5 слов)",
-  "description": "Вступление от Системы БЕЗ имени игрока (1-2 предложения)",
-  "tasks": [
-    "Первое задание с конкретным числом",
-    "Второе задание с конкретным числом",
-    "Третье задание (опционально)"
-  ],
-  "difficulty": "easy/medium/hard"
-}}"""
-
-    response = client.responses.create(
-        model=f"gpt://{YANDEX_CLOUD_FOLDER}/{YANDEX_CLOUD_MODEL}",
-        temperature=0.7,
-        instructions="Ты - Система из аниме. Генерируй только JSON без лишнего текста.",
-        input=prompt,
-        max_output_tokens=500
-    )
+{_answer_format(DAILY_QUEST_FORMAT, count)}"""
 
-    content = response.output_text.strip()
 
-    # Убираем markdown если есть
-    if content.startswith("```json"):
-        content = content.replace("```json", "").replace("```", "").strip()
-    if content.startswith("```"):
-        content = content.replace("```", "").strip()
+def _weekly_prompt(user_name: str, user_history: str = "", count: int = 1) -> str:
+    if count == 1:
+        request_line = f"Создай ОДИН амбициозный недельный квест для игрока {user_name}."
+    else:
+        request_line = f"Создай {count} РАЗНЫХ амбициозных недельных квестов для игрока {user_name}."
 
-    quest_data = json.loads(content)
+    return f"""
+Ты - безжалостная Система из аниме "Поднятие уровня в одиночку", которая выдает недельные квесты для СЕРЬЕЗНОЙ прокачки.
 
-    return quest_data
-
-def generate_weekly_quest(user_name: str, user_history: str = "") -> dict:
-    """
-    Генерирует еженедельный квест для пользователя.
-    """
-
-    prompt = f"""Ты - безжалостная Система из аниме "Поднятие уровня в одиночку", которая выдает недельные квесты для СЕРЬЕЗНОЙ прокачки.
-
-Создай ОДИН амбициозный недельный квест для игрока {user_name}.
+{request_line}
 
 КОНЦЕПЦИЯ: Недельный квест - это масштабное испытание на 7 дней с ИЗМЕРИМЫМИ целями. Только конкретные цифры и реальные результаты.
 
@@ -121,35 +343,105 @@ def generate_weekly_quest(user_name: str, user_history: str = "") -> dict:
 
 {f"История: {user_history}" if user_history else "Первый недельный квест."}
 
-ФОРМАТ ОТВЕТА - только JSON без markdown:
-{{
-  "title": "Название квеста (4-6 слов)",
-  "description": "Вступление от Системы БЕЗ имени игрока (2-3 предложения)",
-  "tasks": [
-    "Первое задание с метриками",
-    "Второе задание с метриками",
-    "Третье задание с метриками",
-    "Четвертое задание с метриками",
-    "Пятое задание с метриками"
-  ],
-  "difficulty": "medium/hard"
-}}"""
-
-    response = client.responses.create(
-        model=f"gpt://{YANDEX_CLOUD_FOLDER}/{YANDEX_CLOUD_MODEL}",
-        temperature=0.7,
-        instructions="Ты - Система из аниме. Генерируй только JSON без лишнего текста.",
-        input=prompt,
-        max_output_tokens=700
+{_answer_format(WEEKLY_QUEST_FORMAT, count)}"""
+
+
+def _answer_format(quest_format: str, count: int) -> str:
+    if count == 1:
+        return f"ФОРМАТ ОТВЕТА - только JSON без markdown:\n{quest_format}"
+
+    return (
+        f"ФОРМАТ ОТВЕТА - только JSON-массив из {count} объектов без markdown, "
+        f"квесты не должны повторять друг друга:\n[\n{quest_format},\n...\n]"
     )
 
-    content = response.output_text.strip()
 
-    if content.startswith("```json"):
-        content = content.replace("```json", "").replace("```", "").strip()
-    if content.startswith("```"):
-        content = content.replace("```", "").strip()
+_PROMPTS = {
+    "daily": _daily_prompt,
+    "weekly": _weekly_prompt,
+}
 
-    quest_data = json.loads(content)
 
-    return quest_data
+async def generate_daily_quest(
+    user_name: str,
+    user_history: str = "",
+    user_id: Optional[int] = None
+) -> dict:
+    """
+    Генерирует ежедневный квест для пользователя.
+    """
+    prompt = _daily_prompt(user_name, user_history)
+    return await _request_quest(prompt, MAX_OUTPUT_TOKENS["daily"], "daily", user_id)
+
+async def generate_weekly_quest(
+    user_name: str,
+    user_history: str = "",
+    user_id: Optional[int] = None
+) -> dict:
+    """
+    Генерирует еженедельный квест для пользователя.
+    """
+    prompt = _weekly_prompt(user_name, user_history)
+    return await _request_quest(prompt, MAX_OUTPUT_TOKENS["weekly"], "weekly", user_id)
+
+
+async def generate_quests_batch(quest_type: str, count: int, user_name: str) -> list[dict]:
+    """
+    Генерирует count квестов одного типа одним запросом (JSON-массив) для
+    пользователей с общим профилем (мимо кэша ответов - пачке нужны новые
+    квесты). Невалидные элементы отбрасываются и
+    догенерируются повторным запросом только на недостающее число.
+    Может вернуть меньше count, если модель так и не дала валидных квестов
+    или догенерация упала (уже готовые квесты при этом не теряются).
+    """
+    quests: list[dict] = []
+
+    for attempt in range(1, BATCH_MAX_ATTEMPTS + 1):
+        missing = count - len(quests)
+        if missing <= 0:
+            break
+
+        prompt = _PROMPTS[quest_type](user_name, count=missing)
+        started_at = time.monotonic()
+        try:
+            response = await _complete(
+                prompt, MAX_OUTPUT_TOKENS[quest_type] * missing, quest_count=missing
+            )
+        except Exception as error:
+            if not quests:
+                raise
+            logger.warning(
+                'Ошибка догенерации пачки, возвращаем готовые квесты',
+                quest_type=quest_type,
+                ready=len(quests),
+                requested=count,
+                error=repr(error)
+            )
+            break
+
+        try:
+            items = _parse_quest_json(response.output_text)
+        except ValueError:
+            items = []
+        if not isinstance(items, list):
+            items = [items]
+
+        valid = [
+            quest for quest in (validate_quest(item, quest_type) for item in items)
+            if quest is not None
+        ][:missing]
+        quests.extend(valid)
+
+        _record_cost(missing, len(valid), time.monotonic() - started_at, response)
+        metrics.increment("ai_batch_invalid_items", max(missing - len(valid), 0))
+
+        if len(valid) < missing:
+            logger.warning(
+                'Часть квестов из пачки не прошла проверку',
+                quest_type=quest_type,
+                requested=missing,
+                valid=len(valid),
+                attempt=attempt
+            )
+
+    return quests
@@ -0,0 +1,153 @@
+"""
+Отложенная (write-behind) запись истории чата.
+
+Сообщения копятся в ограниченной очереди и пишутся в БД одним многострочным
+INSERT - когда набралось CHAT_HISTORY_BATCH_SIZE строк или прошло
+CHAT_HISTORY_FLUSH_MS миллисекунд. Если очередь заполнена, save_message ждет
+(backpressure), а не выбрасывает строки.
+
+Хендлеры апдейтов пишут через save_message_after_commit: сообщение попадает
+в очередь только после commit транзакции апдейта, иначе пачка может уйти
+раньше, чем появится строка нового пользователя (нарушение внешнего ключа).
+Закоммиченные сообщения ставит в очередь DbSessionMiddleware через
+save_committed - обычным await put, так что backpressure тормозит апдейт.
+"""
+import asyncio
+from datetime import datetime
+from typing import Optional
+
+from config.settings import (
+    CHAT_HISTORY_BATCH_SIZE,
+    CHAT_HISTORY_FLUSH_MS,
+    CHAT_HISTORY_BUFFER_SIZE,
+)
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.database import after_commit, async_session_maker
+from database.crud import save_messages
+from utils import metrics
+from utils.logger import logger
+
+# Попыток записи одной пачки, прежде чем сдаться
+FLUSH_ATTEMPTS = 3
+# Ключ session.info с сообщениями из закоммиченных транзакций
+COMMITTED_KEY = "chat_history_committed"
+
+
+class ChatHistoryBuffer:
+    def __init__(self, batch_size: int, flush_interval: float, max_size: int):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: asyncio.Queue[Optional[dict]] = asyncio.Queue(maxsize=max_size)
+        self._task: Optional[asyncio.Task] = None
+
+    async def save_message(self, user_id: int, message_text: str, is_from_user: bool):
+        if self._queue.full():
+            metrics.increment("chat_history_backpressure")
+
+        await self._queue.put(_make_item(user_id, message_text, is_from_user))
+
+    def save_message_after_commit(
+        self,
+        session: AsyncSession,
+        user_id: int,
+        message_text: str,
+        is_from_user: bool
+    ):
+        """
+        Сообщение уйдет в очередь после commit сессии (см. save_committed);
+        при rollback оно отбрасывается.
+        """
+        item = _make_item(user_id, message_text, is_from_user)
+        # Внутри commit ждать очередь нельзя - только помечаем как закоммиченное
+        after_commit(session, lambda: session.info.setdefault(COMMITTED_KEY, []).append(item))
+
+    async def save_committed(self, session: AsyncSession):
+        """
+        Ставит в очередь сообщения уже закоммиченных транзакций сессии.
+        """
+        for item in session.info.pop(COMMITTED_KEY, []):
+            if self._queue.full():
+                metrics.increment("chat_history_backpressure")
+            await self._queue.put(item)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Дописывает все, что осталось в очереди, и останавливает фоновую задачу.
+        """
+        if self._task is None:
+            return
+
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+
+            batch = [item]
+            stopping = False
+            deadline = loop.time() + self.flush_interval
+
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            await self._flush(batch)
+
+            if stopping:
+                return
+
+    async def _flush(self, batch: list[dict]):
+        for attempt in range(1, FLUSH_ATTEMPTS + 1):
+            try:
+                async with async_session_maker() as session:
+                    await save_messages(session, batch)
+                    await session.commit()
+                metrics.increment("chat_history_rows_written", len(batch))
+                metrics.observe("chat_history_batch_size", len(batch))
+                return
+            except Exception:
+                logger.exception(
+                    'Ошибка записи истории чата',
+                    rows=len(batch),
+                    attempt=attempt
+                )
+                if attempt < FLUSH_ATTEMPTS:
+                    await asyncio.sleep(attempt)
+
+        metrics.increment("chat_history_rows_lost", len(batch))
+        logger.error(f'История чата не записана: потеряно строк {len(batch)}')
+
+
+def _make_item(user_id: int, message_text: str, is_from_user: bool) -> dict:
+    return {
+        "user_id": user_id,
+        "message_text": message_text,
+        "is_from_user": is_from_user,
+        "created_at": datetime.utcnow(),
+    }
+
+
+chat_history_buffer = ChatHistoryBuffer(
+    batch_size=CHAT_HISTORY_BATCH_SIZE,
+    flush_interval=CHAT_HISTORY_FLUSH_MS / 1000,
+    max_size=CHAT_HISTORY_BUFFER_SIZE
+)
@@ -0,0 +1,169 @@
+"""
+Таймер истечения квестов.
+
+Min-heap (expires_at, quest_id) в памяти: фоновая задача спит до ближайшего
+дедлайна и проваливает квест через секунды после него, без периодического
+скана quests. Куча загружается из БД при старте и обновляется из crud при
+создании и завершении квестов. Периодическая проверка в планировщике
+остается страховкой (например, для квестов из откаченных транзакций).
+
+Таймер работает только на инстансе с SCHEDULER_ENABLED, а квесты создают
+все инстансы. Поэтому раз в RELOAD_INTERVAL таймер дочитывает из БД квесты,
+истекающие в ближайшие RELOAD_HORIZON, - так в куче оказываются и квесты,
+созданные другими инстансами.
+"""
+import asyncio
+import heapq
+from datetime import datetime, timedelta
+from typing import Optional
+
+from utils import metrics
+from utils.logger import logger
+
+# Сколько квестов проваливать одним UPDATE
+EXPIRY_BATCH_SIZE = 500
+# Через сколько повторить, если запись в БД не удалась
+EXPIRY_RETRY_DELAY = timedelta(seconds=30)
+# Максимальный сон без проверки кучи (страховка от сдвигов часов)
+MAX_SLEEP_SECONDS = 300
+# Как часто и на сколько вперед дочитывать дедлайны из БД
+RELOAD_INTERVAL = timedelta(seconds=60)
+RELOAD_HORIZON = 2 * RELOAD_INTERVAL
+
+
+class QuestExpiryScheduler:
+    def __init__(self):
+        self._heap: list[tuple[datetime, int]] = []
+        # Актуальный дедлайн квеста; записи кучи без совпадения - отмененные
+        self._deadlines: dict[int, datetime] = {}
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._next_reload = datetime.min
+
+    def schedule(self, quest_id: int, expires_at: datetime):
+        # Без запущенного таймера (SCHEDULER_ENABLED=false) кучу не копим
+        if self._task is None:
+            return
+
+        self._deadlines[quest_id] = expires_at
+        heapq.heappush(self._heap, (expires_at, quest_id))
+        metrics.set_gauge("quest_expiry_scheduled", len(self._deadlines))
+
+        if self._heap[0] == (expires_at, quest_id):
+            self._wakeup.set()
+
+    def cancel(self, quest_id: int):
+        # Запись в куче удалится лениво, когда до нее дойдет очередь
+        if self._deadlines.pop(quest_id, None) is not None:
+            metrics.set_gauge("quest_expiry_scheduled", len(self._deadlines))
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    async def start(self):
+        """
+        Загружает дедлайны активных квестов и запускает фоновую задачу.
+        """
+        from database.database import async_session_maker
+        from database.crud import get_pending_quest_deadlines
+
+        async with async_session_maker() as session:
+            deadlines = await get_pending_quest_deadlines(session)
+
+        self._deadlines = dict(deadlines)
+        self._heap = [(expires_at, quest_id) for quest_id, expires_at in deadlines]
+        heapq.heapify(self._heap)
+        metrics.set_gauge("quest_expiry_scheduled", len(self._deadlines))
+
+        self._next_reload = datetime.utcnow() + RELOAD_INTERVAL
+        self._task = asyncio.create_task(self._run())
+        logger.info(f'⏳ Таймер истечения квестов запущен, квестов: {len(self._deadlines)}')
+
+    async def stop(self):
+        if self._task is None:
+            return
+
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def _pop_due(self, now: datetime) -> list[int]:
+        due = []
+        while self._heap and self._heap[0][0] <= now and len(due) < EXPIRY_BATCH_SIZE:
+            expires_at, quest_id = heapq.heappop(self._heap)
+            if self._deadlines.get(quest_id) != expires_at:
+                continue
+            del self._deadlines[quest_id]
+            due.append(quest_id)
+            metrics.observe("quest_expiry_lag_seconds", (now - expires_at).total_seconds())
+        return due
+
+    async def _reload(self, now: datetime):
+        """
+        Добавляет в кучу квесты, истекающие в ближайшие RELOAD_HORIZON,
+        которых в ней еще нет (созданные другими инстансами).
+        """
+        from database.database import async_session_maker
+        from database.crud import get_pending_quest_deadlines
+
+        self._next_reload = now + RELOAD_INTERVAL
+        try:
+            async with async_session_maker() as session:
+                deadlines = await get_pending_quest_deadlines(session, until=now + RELOAD_HORIZON)
+        except Exception:
+            logger.exception('Ошибка чтения дедлайнов квестов')
+            return
+
+        added = 0
+        for quest_id, expires_at in deadlines:
+            if self._deadlines.get(quest_id) != expires_at:
+                self.schedule(quest_id, expires_at)
+                added += 1
+        if added:
+            metrics.increment("quest_expiry_reloaded", added)
+
+    async def _run(self):
+        while True:
+            now = datetime.utcnow()
+            if now >= self._next_reload:
+                await self._reload(now)
+
+            due = self._pop_due(now)
+            if due:
+                await self._expire(due)
+                continue
+
+            timeout = min(MAX_SLEEP_SECONDS, (self._next_reload - now).total_seconds())
+            if self._heap:
+                timeout = min(timeout, (self._heap[0][0] - now).total_seconds())
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), max(timeout, 0))
+            except TimeoutError:
+                pass
+
+    async def _expire(self, quest_ids: list[int]):
+        from database.database import async_session_maker
+        from database.crud import mark_expired_quests
+
+        try:
+            async with async_session_maker() as session:
+                expired_count = await mark_expired_quests(session, quest_ids)
+                await session.commit()
+        except Exception:
+            logger.exception('Ошибка при провале просроченных квестов', quests=len(quest_ids))
+            retry_at = datetime.utcnow() + EXPIRY_RETRY_DELAY
+            for quest_id in quest_ids:
+                self.schedule(quest_id, retry_at)
+            return
+
+        metrics.set_gauge("quest_expiry_scheduled", len(self._deadlines))
+        if expired_count:
+            logger.info(f'⏰ Провалено просроченных квестов: {expired_count}')
+
+
+quest_expiry = QuestExpiryScheduler()
@@ -1,6 +1,8 @@
 """
 Сервис для работы с системой уровней и опыта.
 """
+from collections.abc import Iterable
+from math import isqrt
 
 def calculate_exp_for_level(level: int) -> int:
     if level == 1:
@@ -11,25 +13,27 @@ def calculate_exp_for_level(level: int) -> int:
 
 
 def calculate_total_exp_to_level(level: int) -> int:
-    total = 0
-    for lvl in range(2, level + 1):
-        total += calculate_exp_for_level(lvl)
-    return total
+    # Сумма арифметической прогрессии 10 + 15 + ... + 5 * level
+    if level < 2:
+        return 0
+    return 5 * (level * (level + 1) // 2 - 1)
 
 
 def get_level_from_experience(experience: int) -> tuple[int, int, int]:
-    level = 1
-    total_exp = 0
+    # Уровень L достигнут, если 5 * (L(L+1)/2 - 1) <= experience,
+    # то есть L(L+1) <= (2 * experience + 10) / 5 - решаем через isqrt за O(1)
+    bound = max((2 * experience + 10) // 5, 0)
+    level = max((isqrt(4 * bound + 1) - 1) // 2, 1)
 
-    while True:
-        exp_for_next = calculate_exp_for_level(level + 1)
-        if total_exp + exp_for_next > experience:
-            # Нашли текущий уровень
-            current_level_exp = experience - total_exp
-            return level, current_level_exp, exp_for_next
+    current_level_exp = experience - calculate_total_exp_to_level(level)
+    return level, current_level_exp, calculate_exp_for_level(level + 1)
 
-        total_exp += exp_for_next
-        level += 1
+
+def get_levels_from_experience(experiences: Iterable[int]) -> list[tuple[int, int, int]]:
+    """
+    Пакетный вариант get_level_from_experience для лидербордов и отчетов.
+    """
+    return [get_level_from_experience(experience) for experience in experiences]
 
 
 def calculate_quest_exp(quest_type: str, completed_tasks: int, total_tasks: int) -> int:
@@ -47,3 +51,17 @@ def calculate_quest_exp(quest_type: str, completed_tasks: int, total_tasks: int)
         exp += bonus
 
     return exp
+
+
+def calculate_task_exp(quest_type: str, quest_completed: bool) -> tuple[int, int]:
+    """
+    Опыт за одно отмеченное задание и бонус, если оно завершило квест.
+    """
+    if quest_type == "daily":
+        task_exp = 1
+        bonus = 1
+    else:  # weekly
+        task_exp = 3
+        bonus = 3
+
+    return task_exp, bonus if quest_completed else 0
@@ -0,0 +1,250 @@
+"""
+Кэш ответов LLM с адресацией по содержимому запроса.
+
+Ключ - хэш модели, системных инструкций, промпта и температуры (с шагом 0.1).
+Одинаковые промпты ("Первый квест новичка.") не идут в сеть повторно.
+Под одним ключом хранится несколько вариантов ответа: пользователь не получит
+один и тот же вариант дважды - для него делается новый запрос, и его ответ
+становится еще одним вариантом.
+
+Память: LRU + TTL + лимит по размеру. Если задан LLM_CACHE_DISK_PATH, ответы
+и выданные варианты дублируются в SQLite (aiosqlite) и переживают рестарт.
+"""
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Optional
+
+from config.settings import (
+    LLM_CACHE_ENABLED,
+    LLM_CACHE_TTL_HOURS,
+    LLM_CACHE_MAX_BYTES,
+    LLM_CACHE_MAX_VARIANTS,
+    LLM_CACHE_DISK_PATH,
+)
+from utils import metrics
+from utils.logger import logger
+
+# Сколько пользователей и выданных им вариантов помним в памяти
+MAX_TRACKED_USERS = 10_000
+MAX_SERVED_PER_USER = 500
+
+
+def _variant_hash(variant: str) -> str:
+    return hashlib.sha256(variant.encode()).hexdigest()[:16]
+
+
+@dataclass
+class _CacheEntry:
+    created_at: float
+    # Сколько занял исходный запрос - столько экономит каждое попадание
+    latency: float
+    variants: list[str] = field(default_factory=list)
+
+    @property
+    def size(self) -> int:
+        return sum(len(variant.encode()) for variant in self.variants)
+
+
+class LLMResponseCache:
+    def __init__(
+        self,
+        ttl_seconds: float,
+        max_bytes: int,
+        max_variants: int,
+        disk_path: Optional[str] = None
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.max_variants = max_variants
+        self.disk_path = disk_path or None
+        self._entries: OrderedDict[str, _CacheEntry] = OrderedDict()
+        self._size = 0
+        self._served: OrderedDict[int, dict[str, None]] = OrderedDict()
+        self._db = None
+
+    @staticmethod
+    def make_key(model: str, instructions: str, prompt: str, temperature: float) -> str:
+        payload = json.dumps(
+            [model, instructions, prompt, round(temperature, 1)],
+            ensure_ascii=False
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    async def get(self, key: str, user_id: Optional[int]) -> Optional[dict]:
+        """
+        Возвращает закэшированный ответ, который этот пользователь еще не получал.
+        """
+        entry = self._entries.get(key)
+        if entry is None and self.disk_path:
+            entry = await self._load_entry(key)
+            if entry is not None:
+                self._store(key, entry)
+
+        if entry is not None and time.time() - entry.created_at > self.ttl_seconds:
+            self._remove(key)
+            entry = None
+
+        if entry is None:
+            metrics.increment("llm_cache_misses")
+            return None
+
+        self._entries.move_to_end(key)
+        served = await self._get_served(user_id)
+
+        for variant in entry.variants:
+            variant_hash = _variant_hash(variant)
+            if variant_hash in served:
+                continue
+
+            await self._mark_served(user_id, variant_hash)
+            metrics.increment("llm_cache_hits")
+            metrics.increment("llm_cache_saved_seconds", entry.latency)
+            return json.loads(variant)
+
+        # Все варианты пользователь уже видел - нужен новый ответ
+        metrics.increment("llm_cache_repeats_avoided")
+        metrics.increment("llm_cache_misses")
+        return None
+
+    async def put(self, key: str, value: dict, latency: float, user_id: Optional[int]):
+        """
+        Добавляет ответ модели как новый вариант для ключа.
+        """
+        variant = json.dumps(value, ensure_ascii=False, sort_keys=True)
+
+        entry = self._entries.get(key)
+        if entry is None or time.time() - entry.created_at > self.ttl_seconds:
+            entry = _CacheEntry(created_at=time.time(), latency=latency)
+
+        # Новый объект, а не правка на месте: _store вычитает размер старой записи
+        variants = entry.variants
+        if variant not in variants:
+            variants = (variants + [variant])[-self.max_variants:]
+        entry = _CacheEntry(created_at=entry.created_at, latency=entry.latency, variants=variants)
+
+        self._store(key, entry)
+        await self._mark_served(user_id, _variant_hash(variant))
+
+        if self.disk_path:
+            await self._save_entry(key, entry)
+
+    async def close(self):
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
+
+    # ========== MEMORY ==========
+
+    def _store(self, key: str, entry: _CacheEntry):
+        self._remove(key)
+        self._entries[key] = entry
+        self._size += entry.size
+
+        while self._size > self.max_bytes and len(self._entries) > 1:
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+            metrics.increment("llm_cache_evictions")
+
+        metrics.set_gauge("llm_cache_entries", len(self._entries))
+        metrics.set_gauge("llm_cache_bytes", self._size)
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= entry.size
+
+    async def _get_served(self, user_id: Optional[int]) -> dict[str, None]:
+        if user_id is None:
+            return {}
+
+        served = self._served.get(user_id)
+        if served is None:
+            served = await self._load_served(user_id) if self.disk_path else {}
+            self._served[user_id] = served
+            while len(self._served) > MAX_TRACKED_USERS:
+                self._served.popitem(last=False)
+
+        self._served.move_to_end(user_id)
+        return served
+
+    async def _mark_served(self, user_id: Optional[int], variant_hash: str):
+        if user_id is None:
+            return
+
+        served = await self._get_served(user_id)
+        served[variant_hash] = None
+        while len(served) > MAX_SERVED_PER_USER:
+            del served[next(iter(served))]
+
+        if self.disk_path:
+            db = await self._get_db()
+            await db.execute(
+                "INSERT OR IGNORE INTO llm_cache_served (user_id, variant_hash) VALUES (?, ?)",
+                (user_id, variant_hash)
+            )
+            await db.commit()
+
+    # ========== DISK ==========
+
+    async def _get_db(self):
+        if self._db is None:
+            import aiosqlite
+
+            self._db = await aiosqlite.connect(self.disk_path)
+            await self._db.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "key TEXT PRIMARY KEY, created_at REAL NOT NULL, "
+                "latency REAL NOT NULL, variants TEXT NOT NULL)"
+            )
+            await self._db.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache_served ("
+                "user_id INTEGER NOT NULL, variant_hash TEXT NOT NULL, "
+                "PRIMARY KEY (user_id, variant_hash))"
+            )
+            await self._db.execute(
+                "DELETE FROM llm_cache WHERE created_at < ?",
+                (time.time() - self.ttl_seconds,)
+            )
+            await self._db.commit()
+            logger.info(f'Дисковый кэш LLM: {self.disk_path}')
+        return self._db
+
+    async def _load_entry(self, key: str) -> Optional[_CacheEntry]:
+        db = await self._get_db()
+        async with db.execute(
+            "SELECT created_at, latency, variants FROM llm_cache WHERE key = ?", (key,)
+        ) as cursor:
+            row = await cursor.fetchone()
+
+        if row is None:
+            return None
+        created_at, latency, variants = row
+        return _CacheEntry(created_at=created_at, latency=latency, variants=json.loads(variants))
+
+    async def _save_entry(self, key: str, entry: _CacheEntry):
+        db = await self._get_db()
+        await db.execute(
+            "INSERT OR REPLACE INTO llm_cache (key, created_at, latency, variants) "
+            "VALUES (?, ?, ?, ?)",
+            (key, entry.created_at, entry.latency, json.dumps(entry.variants, ensure_ascii=False))
+        )
+        await db.commit()
+
+    async def _load_served(self, user_id: int) -> dict[str, None]:
+        db = await self._get_db()
+        async with db.execute(
+            "SELECT variant_hash FROM llm_cache_served WHERE user_id = ?", (user_id,)
+        ) as cursor:
+            rows = await cursor.fetchall()
+        return {variant_hash: None for (variant_hash,) in rows}
+
+
+llm_cache = LLMResponseCache(
+    ttl_seconds=LLM_CACHE_TTL_HOURS * 3600,
+    max_bytes=LLM_CACHE_MAX_BYTES,
+    max_variants=LLM_CACHE_MAX_VARIANTS,
+    disk_path=LLM_CACHE_DISK_PATH
+) if LLM_CACHE_ENABLED else None
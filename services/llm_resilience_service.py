@@ -0,0 +1,143 @@
+"""
+Защита от деградации LLM: предохранитель (circuit breaker) и бюджет повторов.
+
+Предохранитель считает подряд идущие сбои - ошибки, таймауты и ответы
+медленнее AI_LATENCY_SLO. После AI_BREAKER_FAILURE_THRESHOLD сбоев он
+размыкается и AI_BREAKER_OPEN_SECONDS секунд сразу отказывает, не дожидаясь
+таймаута. Затем пропускает один пробный запрос (half-open): успех замыкает
+цепь, сбой снова размыкает.
+
+Бюджет повторов не дает повторам умножить нагрузку на упавший сервис:
+каждый запрос добавляет AI_RETRY_BUDGET_RATIO токена, каждый повтор тратит
+один токен, запас ограничен AI_RETRY_BUDGET_TOKENS.
+"""
+import time
+
+from config.settings import (
+    AI_BREAKER_FAILURE_THRESHOLD,
+    AI_BREAKER_OPEN_SECONDS,
+    AI_RETRY_BUDGET_RATIO,
+    AI_RETRY_BUDGET_TOKENS,
+)
+from utils import metrics
+from utils.logger import logger
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+
+# Значение gauge llm_breaker_state для каждого состояния
+_STATE_GAUGE = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(Exception):
+    """Предохранитель разомкнут - запрос к LLM не отправлялся."""
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: int, open_seconds: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        metrics.set_gauge(f"{name}_breaker_state", _STATE_GAUGE[CLOSED])
+
+    def before_request(self) -> None:
+        """
+        Пропускает запрос или бросает CircuitOpenError. В half-open
+        пропускается только один пробный запрос.
+        """
+        if self.state == OPEN:
+            if time.monotonic() - self._opened_at < self.open_seconds:
+                self._reject()
+            self._set_state(HALF_OPEN)
+
+        if self.state == HALF_OPEN:
+            if self._probe_in_flight:
+                self._reject()
+            self._probe_in_flight = True
+
+    def record_success(self, elapsed: float, latency_slo: float) -> None:
+        if elapsed > latency_slo:
+            metrics.increment(f"{self.name}_slo_violations")
+            self.record_failure(reason="slo")
+            return
+
+        self._probe_in_flight = False
+        self._failures = 0
+        if self.state != CLOSED:
+            self._set_state(CLOSED)
+
+    def record_failure(self, reason: str = "error") -> None:
+        self._probe_in_flight = False
+        self._failures += 1
+
+        if self.state == HALF_OPEN or self._failures >= self.failure_threshold:
+            if self.state != OPEN:
+                metrics.increment(f"{self.name}_breaker_opened")
+                logger.warning(
+                    'Предохранитель LLM разомкнут',
+                    breaker=self.name,
+                    failures=self._failures,
+                    reason=reason,
+                    open_seconds=self.open_seconds
+                )
+            self._opened_at = time.monotonic()
+            self._set_state(OPEN)
+
+    def release(self) -> None:
+        """
+        Запрос прерван без результата (отмена) - освобождаем пробный слот.
+        """
+        self._probe_in_flight = False
+
+    def _reject(self):
+        metrics.increment(f"{self.name}_breaker_rejected")
+        raise CircuitOpenError(f"Предохранитель {self.name} разомкнут")
+
+    def _set_state(self, state: str) -> None:
+        if state == self.state:
+            return
+        logger.info('Состояние предохранителя LLM', breaker=self.name, old=self.state, new=state)
+        self.state = state
+        metrics.set_gauge(f"{self.name}_breaker_state", _STATE_GAUGE[state])
+
+
+class RetryBudget:
+    def __init__(self, name: str, ratio: float, max_tokens: float):
+        self.name = name
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self._tokens = max_tokens
+        metrics.set_gauge(f"{name}_retry_budget_tokens", self._tokens)
+
+    def record_request(self) -> None:
+        self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+        metrics.set_gauge(f"{self.name}_retry_budget_tokens", self._tokens)
+
+    def try_spend(self) -> bool:
+        """
+        Списывает токен на повтор. False - бюджет исчерпан, повторять нельзя.
+        """
+        if self._tokens < 1:
+            metrics.increment(f"{self.name}_retry_budget_exhausted")
+            return False
+
+        self._tokens -= 1
+        metrics.set_gauge(f"{self.name}_retry_budget_tokens", self._tokens)
+        return True
+
+
+llm_breaker = CircuitBreaker(
+    "llm",
+    failure_threshold=AI_BREAKER_FAILURE_THRESHOLD,
+    open_seconds=AI_BREAKER_OPEN_SECONDS
+)
+llm_retry_budget = RetryBudget(
+    "llm",
+    ratio=AI_RETRY_BUDGET_RATIO,
+    max_tokens=AI_RETRY_BUDGET_TOKENS
+)
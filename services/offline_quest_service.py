@@ -0,0 +1,157 @@
+"""
+Локальный генератор квестов без сети.
+
+Квест собирается из версионированного каталога шаблонов заданий за
+микросекунды и имеет тот же вид, что и ответ AI:
+{"title", "description", "tasks", "difficulty"}. Используется как запасной
+вариант, когда LLM недоступна или отвечает слишком долго.
+"""
+import random
+from typing import Optional
+
+# Меняется при любой правке каталога - попадает в логи и метрики
+CATALOG_VERSION = 1
+
+# Шаблон задания: (текст с {n}, минимум и максимум для easy, шаг, потолок).
+# Для medium/hard число умножается на DIFFICULTY_SCALE, но не выше потолка
+# (None - без потолка). Число стоит после двоеточия, чтобы не согласовывать
+# его с существительным.
+DAILY_TEMPLATES: dict[str, list[tuple[str, int, int, int, Optional[int]]]] = {
+    "physical": [
+        ("Отжимания: {n}", 20, 40, 5, None),
+        ("Приседания: {n}", 30, 60, 5, None),
+        ("Планка суммарно: {n} сек", 60, 120, 15, None),
+        ("Бег: {n} км", 2, 3, 1, 10),
+        ("Шаги за день: {n}", 6000, 9000, 500, 15000),
+    ],
+    "learning": [
+        ("Выучить новые иностранные слова: {n}", 10, 20, 5, None),
+        ("Прочитать нехудожественную книгу: {n} стр.", 15, 30, 5, None),
+        ("Решить задачи по программированию или математике: {n}", 2, 4, 1, None),
+        ("Пройти уроки онлайн-курса: {n}", 1, 2, 1, 4),
+    ],
+    "productivity": [
+        ("Закрыть задачи из списка дел: {n}", 3, 5, 1, None),
+        ("Работа без телефона и соцсетей: {n} мин", 45, 90, 15, 180),
+        ("Разобрать входящие письма и сообщения: {n}", 10, 20, 5, None),
+        ("Навести порядок в ящиках или на полках: {n}", 1, 3, 1, 5),
+    ],
+    "health": [
+        ("Выпить воды: {n} мл", 1500, 2000, 250, 3000),
+        ("Сон не меньше: {n} ч", 7, 8, 1, 8),
+        ("Овощи или фрукты, порций: {n}", 3, 4, 1, 6),
+        ("Растяжка: {n} мин", 10, 15, 5, None),
+    ],
+    "discipline": [
+        ("Холодный душ: {n} сек", 30, 60, 15, 180),
+        ("Без сахара и сладких напитков: {n} ч", 12, 16, 2, 24),
+        ("Без соцсетей подряд: {n} ч", 4, 6, 1, 12),
+        ("Без фастфуда и снеков: {n} ч", 12, 16, 2, 24),
+    ],
+}
+
+WEEKLY_TEMPLATES: dict[str, list[tuple[str, int, int, int, Optional[int]]]] = {
+    "physical": [
+        ("Бег за неделю: {n} км", 10, 15, 1, 40),
+        ("Отжимания за неделю суммарно: {n}", 200, 300, 25, None),
+        ("Силовые тренировки за неделю: {n}", 3, 3, 1, 6),
+    ],
+    "learning": [
+        ("Выучить новые иностранные слова за неделю: {n}", 70, 100, 10, None),
+        ("Прочитать за неделю: {n} стр.", 100, 150, 10, None),
+        ("Пройти уроки онлайн-курса: {n}", 5, 7, 1, 14),
+    ],
+    "productivity": [
+        ("Завершить крупные задачи или этапы проекта: {n}", 2, 3, 1, 6),
+        ("Сессии глубокой работы по 90 мин: {n}", 4, 5, 1, 10),
+        ("Закрыть задачи из списка дел за неделю: {n}", 15, 20, 1, None),
+    ],
+    "health": [
+        ("Сон не меньше 7 ч, ночей из 7: {n}", 5, 6, 1, 7),
+        ("2 л воды в день, дней из 7: {n}", 5, 6, 1, 7),
+        ("8000 шагов в день, дней из 7: {n}", 4, 5, 1, 7),
+    ],
+    "discipline": [
+        ("Холодный душ, дней из 7: {n}", 5, 6, 1, 7),
+        ("Подъем до 7:00, дней из 7: {n}", 4, 5, 1, 7),
+        ("Без сладкого, дней из 7: {n}", 4, 5, 1, 7),
+    ],
+    "skills": [
+        ("Практика выбранного навыка за неделю: {n} ч", 3, 5, 1, 15),
+        ("Практические упражнения по своей профессии: {n}", 5, 8, 1, None),
+    ],
+}
+
+DIFFICULTY_SCALE = {"easy": 1.0, "medium": 1.5, "hard": 2.0}
+DIFFICULTIES = {"daily": ("easy", "medium", "hard"), "weekly": ("medium", "hard")}
+TASK_COUNTS = {"daily": (2, 3), "weekly": (5, 5)}
+
+TITLES = {
+    "daily": [
+        "Испытание нового дня",
+        "Ежедневная закалка",
+        "Протокол прокачки",
+        "Дневной рубеж Системы",
+    ],
+    "weekly": [
+        "Семь дней стального режима",
+        "Недельное испытание Системы",
+        "Марафон прокачки охотника",
+        "Неделя без права на слабость",
+    ],
+}
+
+DESCRIPTIONS = {
+    "daily": [
+        "Система выдала задание. Невыполнение повлечет штраф.",
+        "Слабость - это выбор. Сегодня ты выбираешь силу.",
+        "Каждое задание приближает тебя к следующему уровню.",
+    ],
+    "weekly": [
+        "Система открывает недельное испытание. Семь дней покажут, чего ты стоишь.",
+        "Большие уровни берутся дисциплиной. У тебя неделя, чтобы это доказать.",
+        "Недельный квест не прощает пропусков. Распредели силы и дойди до конца.",
+    ],
+}
+
+_TEMPLATES = {
+    "daily": DAILY_TEMPLATES,
+    "weekly": WEEKLY_TEMPLATES,
+}
+
+
+def _render_task(
+    template: tuple[str, int, int, int, Optional[int]],
+    scale: float,
+    rng: random.Random
+) -> str:
+    text, low, high, step, limit = template
+    value = rng.randrange(low, high + 1, step)
+    # Масштабированное число округляем до шага шаблона
+    value = max(step, round(value * scale / step) * step)
+    if limit is not None:
+        value = min(value, limit)
+    return text.format(n=value)
+
+
+def generate_offline_quest(quest_type: str, rng: Optional[random.Random] = None) -> dict:
+    """
+    Собирает квест из каталога: задания из разных категорий, числа по сложности.
+    """
+    rng = rng or random
+    templates = _TEMPLATES[quest_type]
+
+    difficulty = rng.choice(DIFFICULTIES[quest_type])
+    task_count = rng.randint(*TASK_COUNTS[quest_type])
+    categories = rng.sample(sorted(templates), task_count)
+    scale = DIFFICULTY_SCALE[difficulty]
+
+    return {
+        "title": rng.choice(TITLES[quest_type]),
+        "description": rng.choice(DESCRIPTIONS[quest_type]),
+        "tasks": [
+            _render_task(rng.choice(templates[category]), scale, rng)
+            for category in categories
+        ],
+        "difficulty": difficulty,
+    }
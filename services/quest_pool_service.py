@@ -0,0 +1,307 @@
+"""
+Пул заранее сгенерированных квестов.
+
+Пул наполняется в фоне в непиковые часы, а выдача квеста (рассылка,
+/generate_daily) забирает готовый квест за O(1). В LLM идем только если пул пуст.
+Пополнение и рассылка просят у модели сразу пачку из AI_BATCH_SIZE квестов.
+Если LLM недоступна или медленная, квест собирает локальный генератор.
+"""
+import asyncio
+import random
+import time
+from collections import deque
+from collections.abc import Awaitable
+from typing import Optional
+
+from config.settings import (
+    QUEST_POOL_TARGET_SIZE,
+    QUEST_POOL_MAX_AGE_HOURS,
+    AI_BATCH_SIZE,
+    AI_MAX_CONCURRENT_REQUESTS,
+    AI_LATENCY_BUDGET,
+    OFFLINE_QUEST_SHARE,
+)
+from services.ai_service import generate_daily_quest, generate_weekly_quest, generate_quests_batch
+from services.llm_resilience_service import CircuitOpenError
+from services.offline_quest_service import CATALOG_VERSION, generate_offline_quest
+from utils import metrics
+from utils.logger import logger
+
+# Имя для промпта: квесты в пуле обезличены (описание пишется без имени игрока)
+POOL_PLAYER_NAME = "Игрок"
+
+# Сколько ошибок LLM подряд прерывают пополнение
+MAX_CONSECUTIVE_FAILURES = 3
+
+_GENERATORS = {
+    "daily": generate_daily_quest,
+    "weekly": generate_weekly_quest,
+}
+
+
+class QuestPool:
+    """
+    Очереди готовых квестов по типу (daily/weekly).
+    Элемент пула - (время генерации, данные квеста).
+    """
+
+    def __init__(
+        self,
+        target_size: int,
+        max_age_seconds: float,
+        batch_size: int,
+        max_batches: int
+    ):
+        self.target_size = target_size
+        self.max_age_seconds = max_age_seconds
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+        self._pools: dict[str, deque[tuple[float, dict]]] = {
+            quest_type: deque() for quest_type in _GENERATORS
+        }
+        # Пачки в полете и число ждущих их получателей, по типу квеста
+        self._batches: dict[str, set[asyncio.Task]] = {
+            quest_type: set() for quest_type in _GENERATORS
+        }
+        self._waiting = dict.fromkeys(_GENERATORS, 0)
+
+    def take(self, quest_type: str) -> Optional[dict]:
+        """
+        Забирает самый старый свежий квест. Протухшие выбрасываются по пути.
+        """
+        pool = self._pools[quest_type]
+        now = time.monotonic()
+
+        while pool:
+            created_at, quest_data = pool.popleft()
+            if now - created_at <= self.max_age_seconds:
+                metrics.increment(f"quest_pool_hits_{quest_type}")
+                self._update_size_gauge(quest_type)
+                return quest_data
+            metrics.increment(f"quest_pool_expired_{quest_type}")
+
+        metrics.increment(f"quest_pool_misses_{quest_type}")
+        self._update_size_gauge(quest_type)
+        return None
+
+    def size(self, quest_type: str) -> int:
+        return len(self._pools[quest_type])
+
+    def _drop_expired(self, quest_type: str) -> None:
+        pool = self._pools[quest_type]
+        now = time.monotonic()
+        while pool and now - pool[0][0] > self.max_age_seconds:
+            pool.popleft()
+            metrics.increment(f"quest_pool_expired_{quest_type}")
+
+    def _update_size_gauge(self, quest_type: str) -> None:
+        metrics.set_gauge(f"quest_pool_size_{quest_type}", self.size(quest_type))
+
+    def add(self, quest_type: str, quest_data: dict) -> None:
+        self._extend(quest_type, [quest_data])
+
+    def _extend(self, quest_type: str, quests: list[dict]) -> None:
+        now = time.monotonic()
+        self._pools[quest_type].extend((now, quest_data) for quest_data in quests)
+        self._update_size_gauge(quest_type)
+
+    async def take_or_generate(self, quest_type: str) -> dict:
+        """
+        Для массовой выдачи: при пустом пуле генерирует пачки (до max_batches
+        одновременно) и забирает квест, как только пачка ляжет в пул.
+        Новая пачка стартует, только если ждущих больше, чем квестов в
+        уже летящих пачках, - лишних запросов к LLM нет.
+        """
+        batches = self._batches[quest_type]
+        quest_data = self.take(quest_type)
+        if quest_data is not None:
+            return quest_data
+
+        self._waiting[quest_type] += 1
+        try:
+            while True:
+                # Проверка и решение о запуске - без await между ними
+                if len(batches) < self.max_batches and (
+                    self._waiting[quest_type] > len(batches) * self.batch_size
+                ):
+                    self._start_batch(quest_type)
+
+                done, _ = await asyncio.wait(batches, return_when=asyncio.FIRST_COMPLETED)
+
+                if self._pools[quest_type]:
+                    quest_data = self.take(quest_type)
+                    if quest_data is not None:
+                        return quest_data
+
+                errors = [
+                    task.exception() for task in done
+                    if not task.cancelled() and task.exception() is not None
+                ]
+                # Пачка упала, других в полете нет - не крутим LLM по кругу
+                if errors and not batches:
+                    raise errors[0]
+        finally:
+            self._waiting[quest_type] -= 1
+
+    def _start_batch(self, quest_type: str) -> asyncio.Task:
+        task = asyncio.create_task(self._generate_batch(quest_type))
+        self._batches[quest_type].add(task)
+        task.add_done_callback(lambda done: self._on_batch_done(quest_type, done))
+        return task
+
+    def _on_batch_done(self, quest_type: str, task: asyncio.Task) -> None:
+        self._batches[quest_type].discard(task)
+        # Ошибку забираем здесь: ждущих пачку получателей может уже не быть
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(
+                'Ошибка генерации пачки квестов',
+                quest_type=quest_type,
+                error=repr(task.exception())
+            )
+
+    async def _generate_batch(self, quest_type: str):
+        quests = await generate_quests_batch(
+            quest_type, self.batch_size, user_name=POOL_PLAYER_NAME
+        )
+        if not quests:
+            raise ValueError("Модель не вернула ни одного валидного квеста")
+        self._extend(quest_type, quests)
+
+    async def refill(self, quest_type: str) -> int:
+        """
+        Догенерирует квесты до target_size. Возвращает число добавленных.
+        """
+        self._drop_expired(quest_type)
+        pool = self._pools[quest_type]
+
+        added = 0
+        failures = 0
+
+        while len(pool) < self.target_size:
+            count = min(self.batch_size, self.target_size - len(pool))
+            try:
+                quests = await generate_quests_batch(
+                    quest_type, count, user_name=POOL_PLAYER_NAME
+                )
+            except CircuitOpenError:
+                logger.warning('LLM недоступна, пополнение пула прервано', quest_type=quest_type)
+                break
+            except Exception:
+                quests = []
+                logger.exception('Ошибка генерации квестов для пула', quest_type=quest_type)
+
+            if not quests:
+                failures += 1
+                if failures >= MAX_CONSECUTIVE_FAILURES:
+                    break
+                continue
+
+            failures = 0
+            self._extend(quest_type, quests)
+            added += len(quests)
+
+        self._update_size_gauge(quest_type)
+        logger.info(
+            'Пул квестов пополнен',
+            quest_type=quest_type,
+            added=added,
+            size=len(pool),
+            target=self.target_size
+        )
+        return added
+
+
+quest_pool = QuestPool(
+    target_size=QUEST_POOL_TARGET_SIZE,
+    max_age_seconds=QUEST_POOL_MAX_AGE_HOURS * 3600,
+    batch_size=AI_BATCH_SIZE,
+    max_batches=AI_MAX_CONCURRENT_REQUESTS
+)
+
+
+def _offline_quest(quest_type: str, reason: str) -> dict:
+    metrics.increment(f"quest_source_offline_{reason}")
+    logger.info(
+        'Квест выдан локальным генератором',
+        quest_type=quest_type,
+        reason=reason,
+        catalog_version=CATALOG_VERSION
+    )
+    return generate_offline_quest(quest_type)
+
+
+def _keep_late_result(task: asyncio.Task, quest_type: str) -> None:
+    # Опоздавший ответ AI не пропадает - он достанется следующему из пула
+    if task.cancelled() or task.exception() is not None:
+        return
+    quest_pool.add(quest_type, task.result())
+
+
+async def _within_budget(coro: Awaitable[dict], quest_type: str) -> Optional[dict]:
+    """
+    Ждет AI не дольше AI_LATENCY_BUDGET. None - бюджет исчерпан; сам запрос
+    при этом не отменяется и по завершении пополняет пул. При отмене ожидающего
+    отменяется и запрос, чтобы не держать слот _llm_semaphore.
+    """
+    if not AI_LATENCY_BUDGET:
+        return await coro
+
+    task = asyncio.ensure_future(coro)
+    try:
+        return await asyncio.wait_for(asyncio.shield(task), AI_LATENCY_BUDGET)
+    except TimeoutError:
+        task.add_done_callback(lambda done: _keep_late_result(done, quest_type))
+        return None
+    except asyncio.CancelledError:
+        task.cancel()
+        # Результат или ошибка запроса, успевшего завершиться, тоже забираются
+        task.add_done_callback(lambda done: _keep_late_result(done, quest_type))
+        raise
+
+
+async def get_quest_data(
+    quest_type: str,
+    user_name: str,
+    user_id: Optional[int] = None,
+    batch: bool = False
+) -> dict:
+    """
+    Выбирает источник квеста: пул, затем LLM (user_id - чтобы кэш ответов
+    не выдал пользователю повтор). batch=True (рассылка) - генерировать сразу
+    пачку и класть остаток в пул.
+
+    Локальный генератор отвечает за долю OFFLINE_QUEST_SHARE запросов, а также
+    когда LLM упала, не уложилась в AI_LATENCY_BUDGET (только интерактивные
+    запросы) или ее предохранитель разомкнут.
+    """
+    if OFFLINE_QUEST_SHARE and random.random() < OFFLINE_QUEST_SHARE:
+        return _offline_quest(quest_type, "share")
+
+    if batch:
+        generation = quest_pool.take_or_generate(quest_type)
+    else:
+        quest_data = quest_pool.take(quest_type)
+        if quest_data is not None:
+            return quest_data
+
+        logger.debug('Пул квестов пуст, генерируем через LLM', quest_type=quest_type)
+        generation = _GENERATORS[quest_type](user_name=user_name, user_id=user_id)
+
+    try:
+        if batch:
+            # Рассылку никто не ждет в чате, а пачка законно идет дольше
+            # интерактивного бюджета - ограничена только таймаутами запроса
+            quest_data = await generation
+        else:
+            quest_data = await _within_budget(generation, quest_type)
+    except CircuitOpenError:
+        return _offline_quest(quest_type, "breaker")
+    except Exception:
+        logger.exception('Ошибка генерации квеста через LLM', quest_type=quest_type)
+        return _offline_quest(quest_type, "error")
+
+    if quest_data is None:
+        return _offline_quest(quest_type, "budget")
+
+    metrics.increment("quest_source_llm")
+    return quest_data
@@ -1,155 +1,337 @@
 """
 Сервис для автоматической рассылки квестов по расписанию.
 """
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from collections.abc import AsyncIterable, AsyncIterator, Awaitable, Callable, Iterable
+from datetime import datetime, timezone
+from functools import cache
+from typing import Any, Optional
+from zoneinfo import ZoneInfo, available_timezones
+
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
 from aiogram import Bot
-from sqlalchemy import select
+from aiogram.exceptions import TelegramRetryAfter
+from sqlalchemy import Row
+from config.settings import (
+    BROADCAST_WORKERS,
+    BROADCAST_MAX_SEND_ATTEMPTS,
+    TELEGRAM_GLOBAL_RATE,
+    TELEGRAM_CHAT_RATE,
+    BROADCAST_USER_BATCH_SIZE,
+)
 from database.database import async_session_maker
-from database.models import User
-from database.crud import create_ai_quest_for_user
-import json
-import logging
+from database.crud import (
+    create_ai_quest_for_user,
+    reserve_quest_slot,
+    release_quest_slot,
+    get_users_page_for_quest,
+)
+from services.quest_pool_service import get_quest_data
+from utils import metrics
+from utils.rate_limiter import TokenBucket
 
 logger = logging.getLogger(__name__)
 
 
-async def send_daily_quests(bot: Bot):
+# Лимиты отправки Telegram общие для всего бота, поэтому ведра живут на уровне модуля
+_global_send_bucket = TokenBucket(rate=TELEGRAM_GLOBAL_RATE, capacity=TELEGRAM_GLOBAL_RATE)
+_chat_send_buckets: dict[int, TokenBucket] = {}
+
+# Порог, после которого из словаря выбрасываются неиспользуемые ведра чатов
+MAX_CHAT_BUCKETS = 10_000
+
+
+def _get_chat_bucket(chat_id: int) -> TokenBucket:
+    bucket = _chat_send_buckets.get(chat_id)
+    if bucket is None:
+        if len(_chat_send_buckets) >= MAX_CHAT_BUCKETS:
+            idle = [key for key, value in _chat_send_buckets.items() if value.is_idle()]
+            for key in idle:
+                del _chat_send_buckets[key]
+        bucket = TokenBucket(rate=TELEGRAM_CHAT_RATE, capacity=1)
+        _chat_send_buckets[chat_id] = bucket
+    return bucket
+
+
+async def _send_with_limits(bot: Bot, chat_id: int, text: str, stats: dict) -> None:
+    """
+    Отправляет сообщение с учетом глобального и per-chat лимита.
+    На 429 ставит на паузу глобальное ведро на retry_after, который вернул
+    Telegram (ждут все воркеры, а не только получивший 429), и повторяет.
+    """
+    for attempt in range(1, BROADCAST_MAX_SEND_ATTEMPTS + 1):
+        await _get_chat_bucket(chat_id).acquire()
+        await _global_send_bucket.acquire()
+
+        try:
+            await bot.send_message(chat_id=chat_id, text=text, parse_mode="Markdown")
+            return
+        except TelegramRetryAfter as e:
+            stats["retry_after"] += 1
+            if attempt == BROADCAST_MAX_SEND_ATTEMPTS:
+                raise
+            logger.warning(f"⏳ Flood control: ждем {e.retry_after} сек (чат {chat_id})")
+            _global_send_bucket.pause(e.retry_after)
+
+
+async def broadcast(
+    bot: Bot,
+    name: str,
+    recipients: Iterable | AsyncIterable,
+    prepare: Callable[[Any], Awaitable[Optional[tuple[int, str]]]],
+    workers: int = BROADCAST_WORKERS
+) -> dict:
     """
-    Генерирует и отправляет ежедневные квесты всем пользователям.
-    Вызывается каждый день в 9:00.
+    Рассылка с ограниченным пулом воркеров.
+
+    prepare(recipient) готовит сообщение (генерация квеста, запись в БД)
+    и возвращает (chat_id, text) или None, если получателя надо пропустить.
+    Очередь между продюсером и воркерами ограничена, поэтому получатели
+    могут приходить потоком.
     """
-    logger.info("🔄 Начинаем генерацию ежедневных квестов...")
+    stats = {"total": 0, "sent": 0, "skipped": 0, "failed": 0, "retry_after": 0}
+    queue: asyncio.Queue = asyncio.Queue(maxsize=workers * 2)
+    started_at = time.monotonic()
 
-    async with async_session_maker() as session:
-        # Получаем всех пользователей
-        result = await session.execute(select(User))
-        users = result.scalars().all()
+    async def worker():
+        while True:
+            recipient = await queue.get()
+            if recipient is None:
+                return
 
-        for user in users:
             try:
-                # ПРОВЕРКА перед генерацией
-                from database.crud import check_can_generate_quest
-                can_generate, _ = await check_can_generate_quest(
-                    session, user.id, "daily"
-                )
-
-                if not can_generate:
-                    logger.info(f"⏭️ Пропускаем {user.telegram_id} - квест еще активен")
+                prepared = await prepare(recipient)
+                if prepared is None:
+                    stats["skipped"] += 1
                     continue
 
-                # Генерируем квест через AI
-                quest = await create_ai_quest_for_user(
-                    session=session,
-                    user=user,
-                    quest_type="daily"
-                )
+                chat_id, text = prepared
+                await _send_with_limits(bot, chat_id, text, stats)
+                stats["sent"] += 1
+            except Exception as e:
+                stats["failed"] += 1
+                logger.error(f"❌ {name}: ошибка для получателя {recipient!r}: {e}")
 
-                # Парсим задания из JSON
-                tasks = json.loads(quest.tasks)
-                tasks_text = "\n".join([f"  • {task}" for task in tasks])
-
-                # Формируем сообщение
-                difficulty_emoji = {
-                    "easy": "🟢",
-                    "medium": "🟡",
-                    "hard": "🔴"
-                }
-                emoji = difficulty_emoji.get(quest.difficulty, "⚪")
-
-                message = (
-                    f"⚔️ **НОВЫЙ ЕЖЕДНЕВНЫЙ КВЕСТ** ⚔️\n\n"
-                    f"{emoji} **{quest.title}**\n\n"
-                    f"📜 {quest.description}\n\n"
-                    f"📋 **Задания:**\n{tasks_text}\n\n"
-                    f"💪 Сложность: {quest.difficulty.upper()}\n\n"
-                    f"Используй /my_quests чтобы увидеть все квесты."
-                )
+    tasks = [asyncio.create_task(worker()) for _ in range(workers)]
 
-                # Отправляем квест пользователю
-                await bot.send_message(
-                    chat_id=user.telegram_id,
-                    text=message,
-                    parse_mode="Markdown"
-                )
+    try:
+        if isinstance(recipients, AsyncIterable):
+            async for recipient in recipients:
+                stats["total"] += 1
+                await queue.put(recipient)
+        else:
+            for recipient in recipients:
+                stats["total"] += 1
+                await queue.put(recipient)
+
+        for _ in tasks:
+            await queue.put(None)
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    elapsed = time.monotonic() - started_at
+    stats["elapsed"] = round(elapsed, 2)
+    stats["per_second"] = round(stats["total"] / elapsed, 2) if elapsed > 0 else 0.0
+
+    # Тик рассылки без получателей - обычное дело, не засоряем логи и метрики
+    if not stats["total"]:
+        return stats
+
+    metrics.increment(f"broadcast_{name}_sent", stats["sent"])
+    metrics.increment(f"broadcast_{name}_failed", stats["failed"])
+    metrics.observe(f"broadcast_{name}_users_per_second", stats["per_second"])
+
+    logger.info(
+        f"📊 {name}: получателей {stats['total']}, отправлено {stats['sent']}, "
+        f"пропущено {stats['skipped']}, ошибок {stats['failed']}, "
+        f"429: {stats['retry_after']}, {stats['elapsed']} сек "
+        f"({stats['per_second']} польз./сек)"
+    )
 
-                logger.info(f"✅ Отправлен дейли квест пользователю {user.telegram_id}")
+    return stats
 
-            except Exception as e:
-                logger.error(f"❌ Ошибка при создании квеста для {user.telegram_id}: {e}")
 
-    logger.info("✅ Генерация ежедневных квестов завершена")
+def _format_daily_message(quest) -> str:
+    tasks = quest.tasks
+    tasks_text = "\n".join([f"  • {task}" for task in tasks])
 
+    difficulty_emoji = {
+        "easy": "🟢",
+        "medium": "🟡",
+        "hard": "🔴"
+    }
+    emoji = difficulty_emoji.get(quest.difficulty, "⚪")
 
-async def send_weekly_quests(bot: Bot):
+    return (
+        f"⚔️ **НОВЫЙ ЕЖЕДНЕВНЫЙ КВЕСТ** ⚔️\n\n"
+        f"{emoji} **{quest.title}**\n\n"
+        f"📜 {quest.description}\n\n"
+        f"📋 **Задания:**\n{tasks_text}\n\n"
+        f"💪 Сложность: {quest.difficulty.upper()}\n\n"
+        f"Используй /my_quests чтобы увидеть все квесты."
+    )
+
+
+def _format_weekly_message(quest) -> str:
+    tasks = quest.tasks
+    tasks_text = "\n".join([f"  {i+1}. {task}" for i, task in enumerate(tasks)])
+
+    difficulty_emoji = {
+        "medium": "🟡",
+        "hard": "🔴"
+    }
+    emoji = difficulty_emoji.get(quest.difficulty, "🔴")
+
+    return (
+        f"🏆 **НОВЫЙ НЕДЕЛЬНЫЙ КВЕСТ** 🏆\n\n"
+        f"{emoji} **{quest.title}**\n\n"
+        f"📜 {quest.description}\n\n"
+        f"📋 **Задания на неделю:**\n{tasks_text}\n\n"
+        f"💪 Сложность: {quest.difficulty.upper()}\n\n"
+        f"У тебя 7 дней чтобы доказать свою силу!\n"
+        f"Используй /my_quests чтобы увидеть все текущие квесты."
+    )
+
+
+_MESSAGE_FORMATTERS = {
+    "daily": _format_daily_message,
+    "weekly": _format_weekly_message,
+}
+
+
+def _make_quest_preparer(quest_type: str):
     """
-    Генерирует и отправляет недельные квесты всем пользователям.
-    Вызывается каждый понедельник в 9:00.
+    Возвращает prepare() для broadcast: проверка кулдауна, генерация квеста
+    и текст сообщения. Соединение с БД не удерживается во время запроса к AI.
     """
-    logger.info("🔄 Начинаем генерацию недельных квестов...")
+    format_message = _MESSAGE_FORMATTERS[quest_type]
 
-    async with async_session_maker() as session:
-        # Получаем всех пользователей
-        result = await session.execute(select(User))
-        users = result.scalars().all()
+    async def prepare(user: Row) -> Optional[tuple[int, str]]:
+        # Короткий резерв слота, генерация без соединения с БД, короткая запись
+        async with async_session_maker() as session:
+            reserved_at, _ = await reserve_quest_slot(session, user.id, quest_type)
+            await session.commit()
 
-        for user in users:
-            try:
-                # ПРОВЕРКА перед генерацией
-                from database.crud import check_can_generate_quest
-                can_generate, _ = await check_can_generate_quest(
-                    session, user.id, "daily"
-                )
+        if reserved_at is None:
+            logger.info(f"⏭️ Пропускаем {user.telegram_id} - квест еще активен")
+            return None
 
-                if not can_generate:
-                    logger.info(f"⏭️ Пропускаем {user.telegram_id} - квест еще активен")
-                    continue
+        try:
+            quest_data = await get_quest_data(quest_type, user_name=user.first_name, batch=True)
 
-                # Генерируем квест через AI
+            async with async_session_maker() as session:
                 quest = await create_ai_quest_for_user(
                     session=session,
                     user=user,
-                    quest_type="weekly"
+                    quest_type=quest_type,
+                    quest_data=quest_data
                 )
+                await session.commit()
+        except Exception:
+            async with async_session_maker() as session:
+                await release_quest_slot(session, user.id, quest_type, reserved_at)
+                await session.commit()
+            raise
 
-                # Парсим задания из JSON
-                tasks = json.loads(quest.tasks)
-                tasks_text = "\n".join([f"  {i+1}. {task}" for i, task in enumerate(tasks)])
-
-                # Формируем сообщение
-                difficulty_emoji = {
-                    "medium": "🟡",
-                    "hard": "🔴"
-                }
-                emoji = difficulty_emoji.get(quest.difficulty, "🔴")
-
-                message = (
-                    f"🏆 **НОВЫЙ НЕДЕЛЬНЫЙ КВЕСТ** 🏆\n\n"
-                    f"{emoji} **{quest.title}**\n\n"
-                    f"📜 {quest.description}\n\n"
-                    f"📋 **Задания на неделю:**\n{tasks_text}\n\n"
-                    f"💪 Сложность: {quest.difficulty.upper()}\n\n"
-                    f"У тебя 7 дней чтобы доказать свою силу!\n"
-                    f"Используй /my_quests чтобы увидеть все текущие квесты."
-                )
+        return user.telegram_id, format_message(quest)
 
-                # Отправляем квест пользователю
-                await bot.send_message(
-                    chat_id=user.telegram_id,
-                    text=message,
-                    parse_mode="Markdown"
-                )
+    return prepare
 
-                logger.info(f"✅ Отправлен недельный квест пользователю {user.telegram_id}")
 
-            except Exception as e:
-                logger.error(f"❌ Ошибка при создании недельного квеста для {user.telegram_id}: {e}")
+async def _iter_users_for_quest(quest_type: str, **bucket) -> AsyncIterator[Row]:
+    """
+    Пользователи без квеста на кулдауне, страницами по id (keyset).
+    В памяти одновременно не больше одной страницы, соединение с БД
+    берется только на время чтения страницы. bucket - фильтр по часу
+    рассылки (см. get_users_page_for_quest).
+    """
+    last_id = 0
+    while True:
+        async with async_session_maker() as session:
+            users = await get_users_page_for_quest(
+                session, quest_type, last_id, BROADCAST_USER_BATCH_SIZE, **bucket
+            )
+
+        if not users:
+            return
+
+        for user in users:
+            yield user
+
+        last_id = users[-1].id
+
+
+@cache
+def _delivery_zones() -> tuple[ZoneInfo, ...]:
+    # /timezone принимает только ключи из базы tzdata - других поясов в users нет
+    return tuple(ZoneInfo(name) for name in sorted(available_timezones()))
+
+
+def _due_buckets(quest_type: str, now: datetime) -> dict[tuple[int, int], list[str]]:
+    """
+    (час, минута) местного времени -> пояса, где сейчас это время.
+    Для недельных - только пояса, где сейчас понедельник.
+    """
+    buckets: dict[tuple[int, int], list[str]] = defaultdict(list)
+    for zone in _delivery_zones():
+        local_now = now.astimezone(zone)
+        if quest_type == "weekly" and local_now.weekday() != 0:
+            continue
+        buckets[(local_now.hour, local_now.minute)].append(zone.key)
+    return dict(buckets)
+
+
+async def _iter_due_users(quest_type: str) -> AsyncIterator[Row]:
+    """
+    Пользователи, у которых по местному времени идет час рассылки
+    (недельные - только в понедельник). Пояса и часы считаются в Python,
+    в БД уходит один постраничный запрос по индексу (timezone, delivery_hour).
+    """
+    due = _due_buckets(quest_type, datetime.now(timezone.utc))
+    if not due:
+        return
+
+    async for user in _iter_users_for_quest(quest_type, due=due):
+        yield user
+
+
+async def send_daily_quests(bot: Bot):
+    """
+    Генерирует и отправляет ежедневные квесты пользователям, у которых
+    наступил час рассылки.
+    """
+    users = _iter_due_users("daily")
+    await broadcast(bot, "daily_quests", users, _make_quest_preparer("daily"))
+
 
-    logger.info("✅ Генерация недельных квестов завершена")
+async def send_weekly_quests(bot: Bot):
+    """
+    Генерирует и отправляет недельные квесты пользователям, у которых
+    наступил час рассылки в понедельник.
+    """
+    users = _iter_due_users("weekly")
+    await broadcast(bot, "weekly_quests", users, _make_quest_preparer("weekly"))
+
+
+async def deliver_quests(bot: Bot):
+    """
+    Тик рассылки (каждые DELIVERY_TICK_MINUTES): вместо одного всплеска в 9:00
+    нагрузка распределяется по часовым поясам и минутам внутри часа.
+    """
+    await send_daily_quests(bot)
+    await send_weekly_quests(bot)
 
 async def check_expired_quests():
     """
     Проверяет и помечает просроченные квесты как failed.
+    Основную работу делает таймер истечения (services.expiry_service),
+    эта редкая проверка - страховка на случай расхождений.
     """
     from database.crud import mark_expired_quests
 
@@ -158,6 +340,7 @@ async def check_expired_quests():
     try:
         async with async_session_maker() as session:
             expired_count = await mark_expired_quests(session)
+            await session.commit()
 
             if expired_count > 0:
                 logger.warning(f'⏰ Помечено просроченных квестов: {expired_count}')
@@ -167,41 +350,100 @@ async def check_expired_quests():
     except Exception as e:
         logger.error(f'❌ Ошибка при проверке просроченных квестов: {e}')
 
-def setup_scheduler(bot: Bot) -> AsyncIOScheduler:
-    from config.settings import SCHEDULER_CHECK_INTERVAL, ENVIRONMENT
+async def refill_quest_pool(quest_type: str):
+    """
+    Пополняет пул готовых квестов (запускается в непиковые часы).
+    """
+    from services.quest_pool_service import quest_pool
+
+    logger.info(f'🧺 Пополнение пула квестов: {quest_type}')
+
+    try:
+        await quest_pool.refill(quest_type)
+    except Exception as e:
+        logger.error(f'❌ Ошибка при пополнении пула квестов {quest_type}: {e}')
+
+async def flush_stats_rollup():
+    """
+    Сбрасывает накопленные дневные агрегаты в БД.
+    """
+    from services.stats_service import stats_rollup
+
+    await stats_rollup.flush()
+
+def setup_scheduler(bot: Bot, leader: bool = True) -> AsyncIOScheduler:
+    """
+    Рассылка и сверка просроченных квестов работают с общей БД и должны идти
+    на одном инстансе (leader, SCHEDULER_ENABLED). Запись дневной статистики
+    и пополнение пула квестов обслуживают состояние в памяти своего процесса,
+    поэтому ставятся на каждом инстансе.
+    """
+    from config.settings import (
+        SCHEDULER_CHECK_INTERVAL,
+        ENVIRONMENT,
+        QUEST_POOL_REFILL_HOUR,
+        STATS_FLUSH_INTERVAL,
+        DELIVERY_TICK_MINUTES,
+    )
 
     scheduler = AsyncIOScheduler()
 
+    if leader:
+        # Cron, а не interval: тики выровнены по началу часа, и каждый сдвиг
+        # внутри часа (id % DELIVERY_JITTER_MINUTES) застает хотя бы один тик
+        scheduler.add_job(
+            deliver_quests,
+            trigger=CronTrigger(minute=f"*/{DELIVERY_TICK_MINUTES}"),
+            args=[bot],
+            id="deliver_quests",
+            name="Рассылка квестов по часовым поясам",
+            coalesce=True,
+            replace_existing=True
+        )
+
+        scheduler.add_job(
+            check_expired_quests,
+            trigger='interval',
+            minutes=SCHEDULER_CHECK_INTERVAL,
+            id='check_expired_quests',
+            name=f'Проверка просроченных квестов ({ENVIRONMENT})',
+            replace_existing=True
+        )
+
     scheduler.add_job(
-        send_daily_quests,
-        trigger=CronTrigger(hour=9, minute=0),
-        args=[bot],
-        id="daily_quests",
-        name="Рассылка ежедневных квестов",
+        refill_quest_pool,
+        trigger=CronTrigger(hour=QUEST_POOL_REFILL_HOUR, minute=0),
+        args=["daily"],
+        id="refill_daily_pool",
+        name="Пополнение пула ежедневных квестов",
         replace_existing=True
     )
 
     scheduler.add_job(
-        send_weekly_quests,
-        trigger=CronTrigger(day_of_week='mon', hour=9, minute=0),
-        args=[bot],
-        id="weekly_quests",
-        name="Рассылка недельных квестов",
+        refill_quest_pool,
+        trigger=CronTrigger(day_of_week='mon', hour=QUEST_POOL_REFILL_HOUR, minute=30),
+        args=["weekly"],
+        id="refill_weekly_pool",
+        name="Пополнение пула недельных квестов",
         replace_existing=True
     )
 
     scheduler.add_job(
-        check_expired_quests,
+        flush_stats_rollup,
         trigger='interval',
-        minutes=SCHEDULER_CHECK_INTERVAL,
-        id='check_expired_quests',
-        name=f'Проверка просроченных квестов ({ENVIRONMENT})',
+        seconds=STATS_FLUSH_INTERVAL,
+        id='flush_stats_rollup',
+        name='Запись дневной статистики',
         replace_existing=True
     )
 
     logger.info("📅 Scheduler настроен:")
-    logger.info("   - Ежедневные квесты: каждый день в 9:00")
-    logger.info("   - Недельные квесты: каждый понедельник в 9:00")
-    logger.info(f"   - Проверка просроченных: каждые {SCHEDULER_CHECK_INTERVAL} мин")
+    if leader:
+        logger.info(f"   - Рассылка квестов по часовым поясам: каждые {DELIVERY_TICK_MINUTES} мин")
+        logger.info(f"   - Сверка просроченных: каждые {SCHEDULER_CHECK_INTERVAL} мин")
+    else:
+        logger.info("   - Рассылка и сверка просроченных: на другом инстансе (SCHEDULER_ENABLED=false)")
+    logger.info(f"   - Пополнение пула квестов: в {QUEST_POOL_REFILL_HOUR}:00")
+    logger.info(f"   - Запись дневной статистики: каждые {STATS_FLUSH_INTERVAL} сек")
 
     return scheduler
@@ -0,0 +1,71 @@
+"""
+Инкрементальные дневные агрегаты (daily_stats) и активность пользователей.
+
+Пути записи (создание пользователя, выдача/выполнение/провал квеста) только
+увеличивают счетчики в памяти, а фоновая задача периодически сбрасывает
+накопленные приращения в daily_stats одним upsert. Так горячие строки
+агрегатов не блокируются на каждом нажатии кнопки.
+"""
+from collections import Counter, defaultdict
+from datetime import date, datetime
+
+from utils.logger import logger
+
+# Ключ строки для метрик, не привязанных к типу и сложности квеста
+ALL = ""
+
+
+class StatsRollup:
+    def __init__(self):
+        self._deltas: dict[tuple[date, str, str], Counter] = defaultdict(Counter)
+        self._active_day = datetime.utcnow().date()
+        self._seen_active: set[int] = set()
+        self._pending_active: set[tuple[date, int]] = set()
+
+    def add(self, quest_type: str = ALL, difficulty: str = ALL, **increments: int):
+        """
+        Например: stats_rollup.add("daily", "easy", quests_issued=1).
+        """
+        today = datetime.utcnow().date()
+        self._deltas[(today, quest_type, difficulty)].update(increments)
+
+    def mark_active(self, user_id: int):
+        """
+        Отмечает активность пользователя. В БД уходит один раз в день.
+        """
+        today = datetime.utcnow().date()
+        if today != self._active_day:
+            self._active_day = today
+            self._seen_active.clear()
+
+        if user_id in self._seen_active:
+            return
+        self._seen_active.add(user_id)
+        self._pending_active.add((today, user_id))
+
+    async def flush(self):
+        """
+        Записывает накопленные приращения. При ошибке они возвращаются в буфер.
+        """
+        from database.database import async_session_maker
+        from database.crud import save_daily_stats, save_user_activity
+
+        deltas, self._deltas = self._deltas, defaultdict(Counter)
+        active, self._pending_active = self._pending_active, set()
+
+        if not deltas and not active:
+            return
+
+        try:
+            async with async_session_maker() as session:
+                await save_daily_stats(session, deltas)
+                await save_user_activity(session, active)
+                await session.commit()
+        except Exception:
+            logger.exception('Ошибка записи дневной статистики')
+            for key, counter in deltas.items():
+                self._deltas[key].update(counter)
+            self._pending_active |= active
+
+
+stats_rollup = StatsRollup()
@@ -0,0 +1,56 @@
+"""
+In-process кэш пользователей по telegram_id (LRU + TTL).
+
+Почти каждый апдейт начинается с get_or_create_user, поэтому id пользователя
+и поля профиля держим в памяти и не ходим за ними в БД на каждое нажатие.
+"""
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+from config.settings import USER_CACHE_SIZE, USER_CACHE_TTL
+
+
+@dataclass(frozen=True)
+class CachedUser:
+    id: int
+    telegram_id: int
+    username: Optional[str]
+    first_name: str
+
+
+class UserCache:
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._items: OrderedDict[int, tuple[float, CachedUser]] = OrderedDict()
+
+    def get(self, telegram_id: int) -> Optional[CachedUser]:
+        item = self._items.get(telegram_id)
+        if item is None:
+            return None
+
+        stored_at, user = item
+        if time.monotonic() - stored_at > self.ttl_seconds:
+            del self._items[telegram_id]
+            return None
+
+        self._items.move_to_end(telegram_id)
+        return user
+
+    def put(self, user: CachedUser) -> None:
+        self._items[user.telegram_id] = (time.monotonic(), user)
+        self._items.move_to_end(user.telegram_id)
+
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def invalidate(self, telegram_id: int) -> None:
+        self._items.pop(telegram_id, None)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+user_cache = UserCache(max_size=USER_CACHE_SIZE, ttl_seconds=USER_CACHE_TTL)
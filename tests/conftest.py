@@ -0,0 +1,23 @@
+"""
+config.settings читает .env.dev из текущей директории и падает без BOT_TOKEN
+и DB_NAME, поэтому тесты запускаются во временной директории с тестовым конфигом.
+"""
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+_workdir = Path(tempfile.mkdtemp(prefix="tg-bot-tests-"))
+(_workdir / ".env.dev").write_text(
+    "BOT_TOKEN=123456:TEST\n"
+    "DATABASE_TYPE=sqlite\n"
+    f"DB_NAME={_workdir / 'test.db'}\n"
+    "YANDEX_CLOUD_API_KEY=test\n"
+    "YANDEX_CLOUD_FOLDER=test\n"
+    "LLM_CACHE_DISK_PATH=\n"
+)
+os.environ.setdefault("ENVIRONMENT", "dev")
+os.chdir(_workdir)
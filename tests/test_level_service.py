@@ -0,0 +1,58 @@
+import pytest
+
+from services.level_service import (
+    calculate_exp_for_level,
+    calculate_total_exp_to_level,
+    get_level_from_experience,
+    get_levels_from_experience,
+)
+
+
+def _old_total_exp_to_level(level: int) -> int:
+    total = 0
+    for lvl in range(2, level + 1):
+        total += calculate_exp_for_level(lvl)
+    return total
+
+
+def _old_level_from_experience(experience: int) -> tuple[int, int, int]:
+    # Прежняя реализация: перебор уровней по одному
+    level = 1
+    total_exp = 0
+
+    while True:
+        exp_for_next = calculate_exp_for_level(level + 1)
+        if total_exp + exp_for_next > experience:
+            current_level_exp = experience - total_exp
+            return level, current_level_exp, exp_for_next
+
+        total_exp += exp_for_next
+        level += 1
+
+
+# Пороги уровней и соседние значения
+THRESHOLDS = [_old_total_exp_to_level(level) for level in range(1, 300)]
+EDGE_VALUES = sorted({value + delta for value in THRESHOLDS for delta in (-1, 0, 1)})
+
+
+@pytest.mark.parametrize("experience", [0, -1, -50, 9, 10, 24, 25])
+def test_level_matches_loop(experience):
+    assert get_level_from_experience(experience) == _old_level_from_experience(experience)
+
+
+def test_level_matches_loop_at_thresholds():
+    for experience in EDGE_VALUES:
+        assert get_level_from_experience(experience) == _old_level_from_experience(experience)
+
+
+def test_level_matches_loop_on_range():
+    experiences = range(-50, 50_000)
+    expected = [_old_level_from_experience(experience) for experience in experiences]
+
+    assert [get_level_from_experience(experience) for experience in experiences] == expected
+    assert get_levels_from_experience(experiences) == expected
+
+
+def test_total_exp_matches_loop():
+    for level in range(-3, 500):
+        assert calculate_total_exp_to_level(level) == _old_total_exp_to_level(level)
@@ -0,0 +1,35 @@
+import asyncio
+
+from services.llm_cache_service import LLMResponseCache
+
+
+def _quest(n: int) -> dict:
+    return {"title": f"Квест {n}", "description": "x" * 500, "tasks": ["a", "b"], "difficulty": "easy"}
+
+
+def _real_size(cache: LLMResponseCache) -> int:
+    return sum(entry.size for entry in cache._entries.values())
+
+
+def test_size_tracks_new_variants_of_same_key():
+    cache = LLMResponseCache(ttl_seconds=3600, max_bytes=10**6, max_variants=5)
+
+    async def run():
+        for n in range(10):
+            await cache.put("key", _quest(n), latency=1.0, user_id=None)
+            assert cache._size == _real_size(cache)
+
+    asyncio.run(run())
+    assert len(cache._entries["key"].variants) == 5
+
+
+def test_max_bytes_is_enforced_across_keys():
+    cache = LLMResponseCache(ttl_seconds=3600, max_bytes=3000, max_variants=5)
+
+    async def run():
+        for n in range(50):
+            await cache.put(f"key{n % 7}", _quest(n), latency=1.0, user_id=None)
+            assert cache._size == _real_size(cache)
+
+    asyncio.run(run())
+    assert cache._size <= 3000 or len(cache._entries) == 1
@@ -0,0 +1,56 @@
+"""
+Простые in-process метрики бота: счетчики, гейджи и наблюдения.
+"""
+from collections import defaultdict
+
+_counters: dict[str, float] = defaultdict(float)
+_gauges: dict[str, float] = {}
+_observations: dict[str, dict[str, float]] = {}
+
+
+def increment(name: str, value: float = 1) -> None:
+    _counters[name] += value
+
+
+def set_gauge(name: str, value: float) -> None:
+    _gauges[name] = value
+
+
+def observe(name: str, value: float) -> None:
+    """
+    Учитывает одно наблюдение (длительность, размер и т.п.): count/sum/max.
+    """
+    stats = _observations.get(name)
+    if stats is None:
+        _observations[name] = {"count": 1, "sum": value, "max": value}
+        return
+
+    stats["count"] += 1
+    stats["sum"] += value
+    if value > stats["max"]:
+        stats["max"] = value
+
+
+def get_counter(name: str) -> float:
+    return _counters.get(name, 0)
+
+
+def hit_ratio(hits_name: str, misses_name: str) -> float:
+    hits = get_counter(hits_name)
+    total = hits + get_counter(misses_name)
+    return hits / total if total else 0.0
+
+
+def snapshot() -> dict:
+    """
+    Возвращает копию всех метрик (для логов и /admin_metrics).
+    """
+    observations = {
+        name: {**stats, "avg": stats["sum"] / stats["count"]}
+        for name, stats in _observations.items()
+    }
+    return {
+        "counters": dict(_counters),
+        "gauges": dict(_gauges),
+        "observations": observations,
+    }
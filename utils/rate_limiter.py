@@ -0,0 +1,60 @@
+"""
+Token bucket для ограничения частоты операций.
+"""
+import asyncio
+import time
+
+
+class TokenBucket:
+    """
+    Ведро на capacity токенов, пополняется со скоростью rate токенов в секунду.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        # До этого момента (time.monotonic) ведро не выдает токенов, см. pause
+        self._blocked_until = 0.0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def try_acquire(self, tokens: float = 1) -> bool:
+        """
+        Забирает токены, если они есть. Не ждет.
+        """
+        self._refill()
+        if self._updated_at < self._blocked_until:
+            return False
+        if self._tokens >= tokens:
+            self._tokens -= tokens
+            return True
+        return False
+
+    async def acquire(self, tokens: float = 1) -> None:
+        """
+        Ждет, пока в ведре наберется нужное число токенов, и забирает их.
+        """
+        while not self.try_acquire(tokens):
+            await asyncio.sleep(max(
+                self._blocked_until - self._updated_at,
+                (tokens - self._tokens) / self.rate
+            ))
+
+    def pause(self, seconds: float) -> None:
+        """
+        Не выдавать токены ближайшие seconds секунд (например, на время
+        flood wait от Telegram). Более ранняя пауза не сокращается.
+        """
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    def is_idle(self) -> bool:
+        """
+        Ведро полное - значит давно не использовалось и его можно удалить.
+        """
+        self._refill()
+        return self._tokens >= self.capacity